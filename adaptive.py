@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : adaptive.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 自适应检测输入尺寸：按图像大小和关注的最小人脸选择输入边长，先验框按输入形状缓存
+"""
+
+import threading
+from collections import OrderedDict
+from typing import List, Sequence
+
+import torch
+import torchvision
+from facetorch.analyzer.detector.post import PriorBox
+from facetorch.analyzer.reader import ImageReader
+from facetorch.datastruct import Dimensions
+from facetorch.transforms import SquarePad
+
+
+class AdaptiveResize:
+    """补成正方形后缩放到 sizes 中的某一档
+
+    检测器能稳定检出的最小人脸约为 detector_min_face 像素（最小先验框），只要原图中 min_face_size
+    像素的人脸缩放后不小于它即可，因此选择不小于 长边 * detector_min_face / min_face_size 的最小一档，
+    且不超过原图长边对应的档位；尺寸只有几档，先验框缓存和模型的形状都保持有限。
+    """
+
+    def __init__(self, sizes: Sequence[int] = (320, 480, 640, 800, 1080), min_face_size: int = 40,
+                 detector_min_face: int = 16):
+        self.sizes = sorted(sizes)
+        self.min_face_size = min_face_size
+        self.detector_min_face = detector_min_face
+        self.pad = SquarePad()
+
+    def select_size(self, height: int, width: int) -> int:
+        long_side = max(height, width)
+        required = long_side * min(1.0, self.detector_min_face / self.min_face_size)
+        for size in self.sizes:
+            if size >= required:
+                return size
+        return self.sizes[-1]
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        size = self.select_size(*tensor.shape[-2:])
+        tensor = self.pad(tensor)
+        if tensor.shape[-1] == size:
+            return tensor
+        return torchvision.transforms.functional.resize(tensor, [size, size], antialias=True)
+
+
+class AdaptiveImageReader(ImageReader):
+    """fix_img_size 为 True 时用 AdaptiveResize 代替配置中的固定尺寸变换，其余与 ImageReader 相同"""
+
+    def __init__(self, transform, device: torch.device, optimize_transform: bool,
+                 sizes: List[int] = (320, 480, 640, 800, 1080), min_face_size: int = 40, detector_min_face: int = 16):
+        super().__init__(transform, device, optimize_transform)
+        self.transform = AdaptiveResize(sizes, min_face_size, detector_min_face)
+
+
+class CachedPriorBox(PriorBox):
+    """按 (高, 宽) 缓存先验框，结果与 PriorBox.forward 相同，缺失时用向量化方式生成"""
+
+    def __init__(self, min_sizes: List[List[int]], steps: List[int], clip: bool, max_entries: int = 32):
+        super().__init__(min_sizes, steps, clip)
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def forward(self, dims: Dimensions) -> torch.Tensor:
+        key = (dims.height, dims.width)
+        with self._lock:
+            priors = self._cache.get(key)
+            if priors is not None:
+                self._cache.move_to_end(key)
+                return priors
+        priors = self._generate(dims.height, dims.width)
+        with self._lock:
+            self._cache[key] = priors
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return priors
+
+    def _generate(self, height: int, width: int) -> torch.Tensor:
+        # 顺序与 PriorBox 一致：特征图、行、列、min_size；用 float64 计算后转 float32，数值完全相同
+        anchors = []
+        for step, min_sizes in zip(self.steps, self.min_sizes):
+            rows, cols = -(-height // step), -(-width // step)
+            cy = (torch.arange(rows, dtype=torch.float64) + 0.5) * step / height
+            cx = (torch.arange(cols, dtype=torch.float64) + 0.5) * step / width
+            cy, cx = torch.meshgrid(cy, cx, indexing="ij")
+            sizes = torch.tensor(min_sizes, dtype=torch.float64)
+            n = len(min_sizes)
+            anchors.append(torch.stack([
+                cx.unsqueeze(-1).expand(rows, cols, n),
+                cy.unsqueeze(-1).expand(rows, cols, n),
+                (sizes / width).expand(rows, cols, n),
+                (sizes / height).expand(rows, cols, n),
+            ], dim=-1).reshape(-1, 4))
+        output = torch.cat(anchors).float()
+        if self.clip:
+            output.clamp_(min=0, max=1)
+        return output
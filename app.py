@@ -1,58 +1,210 @@
 import gradio as gr
+import numpy as np
+import torch
 import torchvision
 
-from main import logger, analyzer, compute_embed_similarity
-from facetorch.datastruct import Response, ImageData
+import hashlib
+import os
+import time
+from importlib.metadata import PackageNotFoundError, version
+from typing import List
+
+from omegaconf import OmegaConf
+
+from main import logger, cfg, get_analyzer, make_predictor_stage, warmup_analyzer
+from facetorch.datastruct import ImageData
+from encoding import encode_response, summarize_response
+from metrics import (FACES_PER_IMAGE, REQUEST_SECONDS, AnalyzerCollector, Profiler, observe_stage,
+                     start_metrics_server, torch_trace)
+from pipeline import ImageSource, add_stage_hook, analyze_data, decode_image, read_tensor, select_stages
+from result_cache import ResultCache, make_key
+from serving import AnalyzeTimeout, AnalyzerPool, ServerBusy, WorkerDied
+from batching import MicroBatcher
+
+
+# 模型配置或权重变化后旧的缓存结果不再有效
+def _model_files(node) -> List[str]:
+    if isinstance(node, dict):
+        paths = [node["path_local"]] if isinstance(node.get("path_local"), str) else []
+        return paths + [path for value in node.values() for path in _model_files(value)]
+    if isinstance(node, list):
+        return [path for value in node for path in _model_files(value)]
+    return []
+
+
+def _config_hash() -> str:
+    """影响分析结果的配置：分析器、推理精度、推理引擎及其选项、库版本和模型文件
+
+    模型文件与冻结模型缓存一样按路径、大小和修改时间区分，替换权重后旧的缓存结果不再有效。
+    """
+    digest = hashlib.sha256()
+    for name in ("analyzer", "precision", "engine"):
+        digest.update(OmegaConf.to_yaml(cfg.get(name) or {}).encode("utf-8"))
+    for package in ("facetorch", "torch", "onnxruntime"):
+        try:
+            digest.update(f"{package}={version(package)}".encode("utf-8"))
+        except PackageNotFoundError:
+            pass
+    for path in sorted(set(_model_files(OmegaConf.to_container(cfg.analyzer)))):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+config_hash = _config_hash()
+
+
+def _content_bytes(image: ImageSource) -> bytes:
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if isinstance(image, torch.Tensor):
+        image = image.cpu().numpy()
+    return np.ascontiguousarray(image).tobytes()
 
 
 class FaceTorch:
-    def __init__(self):
-        self.image_path = None
-        self.response = None
-
-    def analyze_face(self, image_path: str = "test.jpg"):
-        self.image_path = image_path
-        self.response = analyzer.run(
-            path_image=image_path,
-            batch_size=1,
-            fix_img_size=True,
-            return_img_data=True,
-            include_tensors=True,
-            path_output=None,
-        )
-        # logger.debug(f"inference response: {self.response}")
-        result = self.response
-        return result
-
-    def parser_face(self):
+    """分析结果不保存在实例上，而是通过 gr.State 存在各自的会话中，并发用户互不覆盖"""
+
+    def __init__(self, pool: AnalyzerPool = None, batcher: MicroBatcher = None, profiler: Profiler = None):
+        self.pool = pool
+        self.batcher = batcher
+        self.profiler = profiler
+        self.cache = None
+        if cfg.result_cache.enabled:
+            self.cache = ResultCache(max_bytes=cfg.result_cache.max_bytes, disk_dir=cfg.result_cache.disk_dir,
+                                     disk_max_bytes=cfg.result_cache.disk_max_bytes)
+
+    def analyze(self, image: ImageSource, predictors=None, utilizers=None, return_img_data: bool = True,
+                include_tensors: bool = False, keep_original: bool = False):
+        """返回 (response, original)
+
+        image 可以是路径、编码后的字节、NumPy 数组或 uint8 张量；文件只读取一次，图像只解码一次，
+        original 为解码后的原图，命中缓存且 keep_original 为 False 时不解码，返回 None。
+        使用工作进程池时，编码后的字节原样发给工作进程并在那里解码，主进程只在 keep_original 时解码。
+        """
+        # predictors/utilizers 为 None 时执行全部模型，空列表表示只做人脸检测
+        analyzer = get_analyzer()
+        start = time.perf_counter()
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                image = f.read()
+        key = None
+        if self.cache is not None:
+            predictor_names, utilizer_names = select_stages(analyzer, predictors, utilizers, draw=return_img_data)
+            key = make_key(_content_bytes(image), predictors=predictor_names, utilizers=utilizer_names,
+                           fix_img_size=True, include_tensors=include_tensors, return_img_data=return_img_data,
+                           config=config_hash, shape=getattr(image, "shape", None))
+            response = self.cache.get(key)
+            if response is not None:
+                logger.debug("result cache hit: {}", key)
+                REQUEST_SECONDS.labels(source="cache").observe(time.perf_counter() - start)
+                return response, decode_image(image) if keep_original else None
+        options = dict(batch_size=1, return_img_data=return_img_data, include_tensors=include_tensors,
+                       path_output=None, predictors=predictors, utilizers=utilizers)
+        trace_path = self.profiler.next_trace_path() if self.profiler is not None else None
+        if self.pool is not None:
+            # 编码后的字节远小于解码后的张量，进程间只传递前者
+            original = decode_image(image) if keep_original else None
+            if isinstance(image, memoryview):
+                # memoryview 不能 pickle
+                image = image.tobytes()
+            try:
+                response = self.pool.analyze(image=image, fix_img_size=True, profile_path=trace_path,
+                                             timeout=cfg.serving.timeout, **options)
+            except ServerBusy:
+                raise gr.Error("服务繁忙，请稍后重试")
+            except AnalyzeTimeout:
+                raise gr.Error(f"分析超时（{cfg.serving.timeout} 秒），请稍后重试")
+            except WorkerDied:
+                raise gr.Error("分析进程异常退出，请重试")
+        else:
+            original = decode_image(image)
+            with torch_trace(trace_path):
+                data = read_tensor(analyzer, original, fix_img_size=True)
+                response = analyze_data(analyzer, data, batcher=self.batcher, **options)
+        REQUEST_SECONDS.labels(source="analyzer").observe(time.perf_counter() - start)
+        FACES_PER_IMAGE.observe(len(response.faces))
+        if key is not None:
+            self.cache.put(key, response)
+        logger.opt(lazy=True).debug("inference response: {}",
+                                    lambda: summarize_response(response, cfg.logging.summary_max_chars))
+        return response, original
+
+    def analyze_face(self, image_path: ImageSource = "test.jpg", predictors=None, utilizers=None,
+                     return_img_data: bool = True, include_tensors: bool = False):
+        return self.analyze(image_path, predictors, utilizers, return_img_data, include_tensors)[0]
+
+    def analyze_face_session(self, image_path: str, predictors=None, utilizers=None):
+        # 界面上的 JSON 只包含元数据和 base64 嵌入向量，绘制后的图像和解码后的原图保存在会话中由 parser_face 显示
+        response, original = self.analyze(image_path, predictors, utilizers, keep_original=True)
+        return encode_response(response), {"original": original, "response": response}
+
+    def parser_face(self, session: dict = None):
+        response = (session or {}).get("response")
         # 如果不是是ImageData类型
-        if isinstance(self.response, ImageData):
-            # 从输入图像的路径读取图像PIL
-            input_image = torchvision.transforms.functional.to_pil_image(torchvision.io.read_image(self.image_path))
+        if isinstance(response, ImageData):
+            # 分析时已经解码的原图，不再重新读取文件
+            input_image = torchvision.transforms.functional.to_pil_image(session["original"])
             # 输出图像
-            pil_image = torchvision.transforms.functional.to_pil_image(self.response.img)
+            pil_image = torchvision.transforms.functional.to_pil_image(response.img)
             return [input_image, pil_image]
         else:
             logger.error("没有返回人脸图像数据")
             return [None, None]
 
 
-face_torch = FaceTorch()
+def build_demo(face_torch: FaceTorch) -> gr.Blocks:
+    # 并发数：多进程模式下与工作进程数一致；微批处理时允许凑满一个批次的请求同时进入；否则在同一个分析器上串行
+    concurrency = max(cfg.serving.workers, 1)
+    if isinstance(face_torch.batcher, MicroBatcher):
+        concurrency = face_torch.batcher.max_batch_size
+    with gr.Blocks() as demo:
+        session = gr.State()
+        gr.Markdown("# 人脸分析算法接口")
+        with gr.Row():
+            image_path = gr.File(label="选择图片")
+            response = gr.Json(label="检测结果")
+        with gr.Row():
+            predictors = gr.CheckboxGroup(choices=list(cfg.analyzer.predictor), value=list(cfg.analyzer.predictor),
+                                          label="预测模型（不选则只做人脸检测）")
+            utilizers = gr.CheckboxGroup(choices=list(cfg.analyzer.utilizer), value=list(cfg.analyzer.utilizer),
+                                         label="后处理")
+        predict_button = gr.Button(value="分析")
+        predict_button.click(fn=face_torch.analyze_face_session, inputs=[image_path, predictors, utilizers],
+                             outputs=[response, session], api_name="analyze_face", concurrency_limit=concurrency)
 
-with gr.Blocks() as demo:
-    gr.Markdown("# 人脸分析算法接口")
-    with gr.Row():
-        image_path = gr.File(label="选择图片")
-        response = gr.Json(label="检测结果")
-    predict_button = gr.Button(value="分析")
-    predict_button.click(fn=face_torch.analyze_face, inputs=image_path, outputs=response, api_name="analyze_face")
+        with gr.Row():
+            origin_image = gr.Image(label="原始图像")
+            face_image = gr.Image(label="绘制图像")
+        parser_button = gr.Button(value="解析结果")
+        parser_button.click(fn=face_torch.parser_face, inputs=session, outputs=[origin_image, face_image],
+                            api_name="parser_face")
+    demo.queue(max_size=cfg.serving.queue_size)
+    return demo
 
-    with gr.Row():
-        origin_image = gr.Image(label="原始图像")
-        face_image = gr.Image(label="绘制图像")
-    parser_button = gr.Button(value="解析结果")
-    parser_button.click(fn=face_torch.parser_face, inputs=None, outputs=[origin_image, face_image],
-                        api_name="parser_face")
 
-# 启动 Gradio 服务，并创建共享链接
-demo.launch()
+if __name__ == "__main__":
+    pool = AnalyzerPool(cfg.serving.workers, cfg.serving.queue_size) if cfg.serving.workers > 0 else None
+    batcher = None
+    if pool is None:
+        # 进程内推理时在启动阶段完成预热，多进程模式由各工作进程自行预热
+        warmup_analyzer(get_analyzer())
+    if pool is None and cfg.serving.micro_batch.enabled:
+        batcher = MicroBatcher(get_analyzer(), max_batch_size=cfg.serving.micro_batch.max_batch_size,
+                               max_wait_ms=cfg.serving.micro_batch.max_wait_ms)
+    elif pool is None:
+        batcher = make_predictor_stage(get_analyzer(), batch_size=1)
+    profiler = None
+    if cfg.metrics.enabled:
+        profiler = Profiler(cfg.metrics.trace_dir)
+    face_torch = FaceTorch(pool, batcher, profiler)
+    if cfg.metrics.enabled:
+        # 多进程模式下工作进程的阶段耗时随结果返回，同样经过这个回调
+        add_stage_hook(observe_stage)
+        collector = AnalyzerCollector(queue_depth=(lambda: pool.queue_depth) if pool else None,
+                                      cache=face_torch.cache, worker_pids=(lambda: pool.pids) if pool else None)
+        start_metrics_server(cfg.metrics.port, profiler, collector)
+    demo = build_demo(face_torch)
+    # 启动 Gradio 服务，并创建共享链接
+    demo.launch()
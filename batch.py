@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : batch.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 批量分析目录、通配符或清单中的图像，读取解码在工作线程中预取，结果逐行写入 JSONL
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator
+
+from main import cfg, get_analyzer, logger, make_predictor_stage
+from pipeline import analyze_data, face_to_dict, read_image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def iter_inputs(source: str) -> Iterator[str]:
+    """支持目录（递归）、通配符以及 .txt/.jsonl 清单"""
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+    elif source.endswith(".jsonl"):
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)["path"]
+    elif source.endswith(".txt"):
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+    else:
+        yield from sorted(glob.glob(source, recursive=True))
+
+
+def run_batch(paths: Iterable[str], path_output: str, workers: int = 4, prefetch: int = 16,
+              batch_size: int = None, fix_img_size: bool = None, log_every: int = 100) -> Dict:
+    """主线程执行检测和预测，同时由线程池读取后续图像"""
+    analyzer = get_analyzer()
+    batch_size = cfg.batch_size if batch_size is None else batch_size
+    fix_img_size = cfg.fix_img_size if fix_img_size is None else fix_img_size
+    stage = make_predictor_stage(analyzer, batch_size=batch_size)
+    n_images = n_faces = n_errors = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(path_output, "w", encoding="utf-8") as out:
+        pending = deque()
+        paths = iter(paths)
+
+        def submit_next():
+            path = next(paths, None)
+            if path is not None:
+                pending.append((path, pool.submit(read_image, analyzer, path, fix_img_size)))
+
+        for _ in range(prefetch):
+            submit_next()
+
+        while pending:
+            path, future = pending.popleft()
+            submit_next()
+            record = {"path": path}
+            try:
+                response = analyze_data(analyzer, future.result(), batch_size=batch_size, batcher=stage)
+                record["faces"] = [face_to_dict(face) for face in response.faces]
+                n_faces += len(response.faces)
+            except Exception as e:
+                logger.error(f"failed to analyze {path}: {e}")
+                record["error"] = str(e)
+                n_errors += 1
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            n_images += 1
+            if n_images % log_every == 0:
+                elapsed = time.perf_counter() - start
+                logger.info(f"{n_images} images, {n_images / elapsed:.2f} images/s, {n_faces / elapsed:.2f} faces/s")
+
+    elapsed = time.perf_counter() - start
+    stats = {"images": n_images, "faces": n_faces, "errors": n_errors, "seconds": elapsed,
+             "images_per_second": n_images / elapsed if elapsed else 0.0,
+             "faces_per_second": n_faces / elapsed if elapsed else 0.0}
+    logger.info(f"batch finished: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量人脸分析")
+    parser.add_argument("source", help="图像目录、通配符或 .txt/.jsonl 清单")
+    parser.add_argument("--output", default="results.jsonl", help="结果 JSONL 文件")
+    parser.add_argument("--workers", type=int, default=4, help="读取解码线程数")
+    parser.add_argument("--prefetch", type=int, default=16, help="预取图像数量")
+    args = parser.parse_args()
+
+    run_batch(iter_inputs(args.source), args.output, workers=args.workers, prefetch=args.prefetch)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : batching.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 动态微批处理，把并发请求的人脸合并成一个批次，每个预测器只执行一次后再按请求拆分结果
+"""
+
+import queue
+import threading
+import time
+from typing import List
+
+import torch
+from facetorch import FaceAnalyzer
+from facetorch.datastruct import ImageData
+from loguru import logger
+
+from pipeline import timed_stage
+
+
+class _Pending:
+    def __init__(self, data: ImageData, predictor_names: List[str]):
+        self.data = data
+        self.predictor_names = set(predictor_names)
+        self.done = threading.Event()
+        self.error = None
+
+
+class MicroBatcher:
+    """请求线程完成检测和统一后提交人脸，由后台线程凑批执行预测器
+
+    第一张请求到达后最多等待 max_wait_ms，或人脸数达到 max_batch_size 即开始执行，
+    延迟上限可控。
+    """
+
+    def __init__(self, analyzer: FaceAnalyzer, max_batch_size: int = 8, max_wait_ms: float = 10):
+        self.analyzer = analyzer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def predict(self, data: ImageData, predictor_names: List[str]) -> ImageData:
+        if len(data.faces) == 0 or not predictor_names:
+            return data
+        pending = _Pending(data, predictor_names)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return data
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        n_faces = len(batch[0].data.faces)
+        deadline = time.monotonic() + self.max_wait
+        while n_faces < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            n_faces += len(pending.data.faces)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run(batch)
+            except Exception as e:
+                logger.exception("micro batch failed")
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+    def _run(self, batch: List[_Pending]):
+        logger.opt(lazy=True).debug("micro batch: {} requests, {} faces", lambda: len(batch),
+                                    lambda: sum(len(p.data.faces) for p in batch))
+        for predictor_name in self.analyzer.predictors:
+            members = [(pending, i) for pending in batch if predictor_name in pending.predictor_names
+                       for i in range(len(pending.data.faces))]
+            for start in range(0, len(members), self.max_batch_size):
+                chunk = members[start:start + self.max_batch_size]
+                face_batch_tensor = torch.stack([pending.data.faces[i].tensor for pending, i in chunk])
+                with timed_stage(f"predict.{predictor_name}"):
+                    preds = self.analyzer.predictors[predictor_name].run(face_batch_tensor)
+                for (pending, i), pred in zip(chunk, preds):
+                    pending.data.faces[i].preds[predictor_name] = pred
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : benchmark.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 分阶段性能基准：读取、检测、统一、各预测器和后处理器的 p50/p95 耗时、吞吐和峰值内存，结果为 JSON，可跨提交对比
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+from main import cfg, path_img_input
+
+# (名称, 网格边长, 输出尺寸)：把 test.jpg 平铺成 grid x grid 得到不同人脸数，再缩放到目标分辨率；grid 为 0 时是空白图
+SYNTHETIC_IMAGES = [
+    ("blank_1080", 0, (1080, 1080)),
+    ("test", 1, None),
+    ("tile2_1080", 2, (1080, 1080)),
+    ("tile3_1920", 3, (1080, 1920)),
+    ("test_480", 1, (480, 480)),
+]
+
+
+def make_images(path_image: str = path_img_input) -> Dict:
+    import torch
+    import torchvision
+    from torchvision.transforms.functional import resize
+
+    base = torchvision.io.read_image(path_image, mode=torchvision.io.ImageReadMode.RGB)
+    images = {}
+    for name, grid, size in SYNTHETIC_IMAGES:
+        if grid == 0:
+            image = torch.zeros((3,) + tuple(size), dtype=torch.uint8)
+        else:
+            image = base.repeat(1, grid, grid)
+            if size is not None:
+                image = resize(image, list(size), antialias=True)
+        images[name] = image.contiguous()
+    return images
+
+
+def percentiles(values: List[float]) -> Dict:
+    values = np.asarray(values) * 1000
+    return {"p50_ms": round(float(np.percentile(values, 50)), 3), "p95_ms": round(float(np.percentile(values, 95)), 3),
+            "mean_ms": round(float(values.mean()), 3), "n": int(values.size)}
+
+
+def _run_config(config: Dict, repeat: int, warmup_runs: int) -> Dict:
+    """在独立的子进程中执行一组参数，保证线程数、optimize_transforms 生效且峰值内存互不影响"""
+    import torch
+    from omegaconf import OmegaConf
+
+    from loader import LazyFaceAnalyzer
+    from pipeline import add_stage_hook, analyze_data, read_tensor
+    from predict_stage import PredictorStage
+
+    torch.set_num_threads(config["threads"])
+    run_cfg = OmegaConf.create(OmegaConf.to_container(cfg, resolve=False))
+    run_cfg.analyzer.optimize_transforms = config["optimize_transforms"]
+    cache_dir = run_cfg.model_cache.dir if run_cfg.model_cache.enabled else None
+    precision = OmegaConf.to_container(run_cfg.precision) if "precision" in run_cfg else None
+    analyzer = LazyFaceAnalyzer(run_cfg.analyzer, cache_dir=cache_dir, precision=precision, engine=config["engine"],
+                                engine_options=OmegaConf.to_container(run_cfg.engine.onnx))
+
+    predictor_stage = None
+    if run_cfg.predict_stage.enabled:
+        predictor_stage = PredictorStage(analyzer, batch_size=config["batch_size"],
+                                         workers=run_cfg.predict_stage.workers,
+                                         shared_preprocess=run_cfg.predict_stage.shared_preprocess)
+
+    stages = defaultdict(float)
+    add_stage_hook(lambda name, seconds: stages.__setitem__(name, stages[name] + seconds))
+
+    results = {}
+    for name, image in make_images().items():
+        timings = defaultdict(list)
+        n_faces = 0
+        for i in range(warmup_runs + repeat):
+            stages.clear()
+            start = time.perf_counter()
+            data = read_tensor(analyzer, image, fix_img_size=config["fix_img_size"])
+            response = analyze_data(analyzer, data, batch_size=config["batch_size"], batcher=predictor_stage)
+            total = time.perf_counter() - start
+            if i < warmup_runs:
+                continue
+            timings["total"].append(total)
+            for stage_name, seconds in stages.items():
+                timings[stage_name].append(seconds)
+            n_faces = len(response.faces)
+        total_seconds = sum(timings["total"])
+        results[name] = {
+            "size": list(image.shape[1:]),
+            "faces": n_faces,
+            "images_per_s": round(repeat / total_seconds, 3),
+            "faces_per_s": round(repeat * n_faces / total_seconds, 3),
+            "stages": {stage_name: percentiles(values) for stage_name, values in timings.items()},
+        }
+    if predictor_stage is not None:
+        predictor_stage.close()
+    # Linux 上 ru_maxrss 单位为 KB，macOS 为字节
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = max_rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+    return {"config": config, "peak_rss_mb": round(peak_rss_mb, 1), "images": results}
+
+
+def environment() -> Dict:
+    import torch
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        from importlib.metadata import version
+        facetorch_version = version("facetorch")
+    except Exception:
+        facetorch_version = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "torch": torch.__version__, "facetorch": facetorch_version, "device": cfg.analyzer.device,
+            "cpu_count": os.cpu_count(), "machine": platform.machine()}
+
+
+def run_benchmark(batch_sizes: List[int], fix_img_sizes: List[bool], optimize_transforms: List[bool],
+                  threads: List[int], engines: List[str] = ("torchscript",), repeat: int = 10,
+                  warmup_runs: int = 2) -> Dict:
+    ctx = mp.get_context("spawn")
+    runs = []
+    for batch_size, fix_img_size, optimize, n_threads, engine in itertools.product(
+            batch_sizes, fix_img_sizes, optimize_transforms, threads, engines):
+        config = {"batch_size": batch_size, "fix_img_size": fix_img_size, "optimize_transforms": optimize,
+                  "threads": n_threads, "engine": engine}
+        print(f"running {config}", file=sys.stderr)
+        with ctx.Pool(1) as pool:
+            runs.append(pool.apply(_run_config, (config, repeat, warmup_runs)))
+    return {"environment": environment(), "repeat": repeat, "runs": runs}
+
+
+def _index(report: Dict) -> Dict:
+    index = {}
+    for run in report["runs"]:
+        config_key = json.dumps(run["config"], sort_keys=True)
+        for image, result in run["images"].items():
+            for stage, stats in result["stages"].items():
+                index[(config_key, image, stage)] = stats["p50_ms"]
+    return index
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.1) -> List[str]:
+    """返回 p50 比基线慢超过 threshold 的 (参数, 图像, 阶段)"""
+    old, new = _index(baseline), _index(current)
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] > 0 and new[key] > old[key] * (1 + threshold):
+            config_key, image, stage = key
+            regressions.append(f"{config_key} {image} {stage}: {old[key]:.2f}ms -> {new[key]:.2f}ms")
+    return regressions
+
+
+def _bools(value: str) -> List[bool]:
+    return [v.strip().lower() in ("1", "true", "yes") for v in value.split(",")]
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="facetorch 分阶段性能基准")
+    parser.add_argument("--batch-size", type=_ints, default=[cfg.batch_size])
+    parser.add_argument("--fix-img-size", type=_bools, default=[cfg.fix_img_size])
+    parser.add_argument("--optimize-transforms", type=_bools, default=[True, False])
+    parser.add_argument("--threads", type=_ints, default=[os.cpu_count()])
+    parser.add_argument("--engine", type=lambda value: value.split(","), default=[cfg.engine.name])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None, help="与之前的结果对比，p50 变慢超过阈值时返回非零")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.batch_size, args.fix_img_size, args.optimize_transforms, args.threads, args.engine,
+                           repeat=args.repeat, warmup_runs=args.warmup)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"saved {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for line in regressions:
+            print(f"regression: {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
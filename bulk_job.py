@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : bulk_job.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 对象存储前缀的分片批量分析：列举一次生成分片清单，多进程、多机器通过存储或本地文件领取分片，逐对象检查点，分片结果用 store_file 写回
+"""
+
+import argparse
+import fcntl
+import json
+import multiprocessing as mp
+import os
+import socket
+import tempfile
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+from batch import IMAGE_EXTENSIONS
+from gradio_demo.filemanager.data_repo import RemoteEntry
+from gradio_demo.filemanager.data_repo_registry import get_data_repo
+from gradio_demo.filemanager.filemanager import CFG_PATH
+from main import cfg, get_analyzer, logger, make_predictor_stage
+from pipeline import analyze_data, face_to_dict, read_image
+
+PLAN_KEY = "plan"
+
+
+@dataclass
+class JobSpec:
+    """任务描述，所有工作进程（包括其他机器上的）使用相同的参数
+
+    job_prefix 下的布局：
+        manifests/shard-00000.jsonl       分片中的对象，每行一个 {"name", "size", "etag", "mtime"}
+        manifests/plan.json               清单全部写完后才写入，存在即表示规划完成
+        claims/shard-00000.json           repo 协调方式的租约
+        results/shard-00000.partial.jsonl 检查点：已完成对象的结果
+        results/shard-00000.jsonl         分片完成后的最终结果
+    """
+    prefix: str
+    job_prefix: str
+    n_shards: int = 256
+    repo_cfg: str = CFG_PATH
+    # "repo" 通过存储中的租约文件协调，否则为本地协调文件的路径（同一台机器或共享文件系统）
+    coordinator: str = "repo"
+    lease_seconds: float = 600
+    checkpoint_every: int = 500
+    checkpoint_seconds: float = 60
+    extensions: Sequence[str] = IMAGE_EXTENSIONS
+    batch_size: int = None
+    fix_img_size: bool = None
+    read_workers: int = 4
+    prefetch: int = 16
+    # 没有可领取的分片时，等待其他进程的租约完成或过期，直到所有分片完成
+    wait: bool = True
+
+    def manifest(self, shard: int) -> str:
+        return f"{self.job_prefix}/manifests/{shard_name(shard)}.jsonl"
+
+    @property
+    def plan(self) -> str:
+        return f"{self.job_prefix}/manifests/plan.json"
+
+    def partial(self, shard: int) -> str:
+        return f"{self.job_prefix}/results/{shard_name(shard)}.partial.jsonl"
+
+    def result(self, shard: int) -> str:
+        return f"{self.job_prefix}/results/{shard_name(shard)}.jsonl"
+
+
+def shard_name(shard: int) -> str:
+    return f"shard-{shard:05d}"
+
+
+def shard_of(name: str, n_shards: int) -> int:
+    """按对象名的 crc32 分片，与列举顺序和机器无关"""
+    return zlib.crc32(name.encode("utf-8")) % n_shards
+
+
+class Coordinator:
+    """分片租约：领取后在 lease_seconds 内有效，检查点时续约；进程崩溃后租约过期，其他进程可接手"""
+
+    def __init__(self, owner: str, lease_seconds: float = 600):
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+
+    def _lease(self, state: str = "running") -> Dict:
+        return {"owner": self.owner, "expires": time.time() + self.lease_seconds, "state": state}
+
+    def _available(self, lease: Optional[Dict]) -> bool:
+        if lease is None:
+            return True
+        if lease["state"] == "done":
+            return False
+        return lease["owner"] == self.owner or lease["expires"] < time.time()
+
+    def _owned(self, lease: Optional[Dict]) -> bool:
+        return lease is not None and lease["owner"] == self.owner and lease["state"] == "running"
+
+
+class LocalCoordinator(Coordinator):
+    """所有租约保存在一个 JSON 文件中，读改写在 flock 下进行，写入时原子替换"""
+
+    def __init__(self, path: str, owner: str, lease_seconds: float = 600):
+        super().__init__(owner, lease_seconds)
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                leases = {}
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        leases = json.load(f)
+                yield leases
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _update(self, key: str, update) -> Optional[Dict]:
+        with self._locked() as leases:
+            lease = update(leases.get(key))
+            if lease is None:
+                return leases.get(key)
+            leases[key] = lease
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(leases, f)
+            os.replace(tmp_path, self.path)
+            return lease
+
+    def claim(self, key: str) -> bool:
+        return self._owned(self._update(key, lambda lease: self._lease() if self._available(lease) else None))
+
+    def renew(self, key: str) -> bool:
+        return self._owned(self._update(key, lambda lease: self._lease() if self._owned(lease) else None))
+
+    def complete(self, key: str):
+        self._update(key, lambda lease: self._lease("done"))
+
+    def is_done(self, key: str) -> bool:
+        with self._locked() as leases:
+            lease = leases.get(key)
+        return lease is not None and lease["state"] == "done"
+
+
+class RepoCoordinator(Coordinator):
+    """租约保存在存储中（claims/<key>.json），多台机器只需访问同一个桶或 SFTP 目录
+
+    MinIO 和 SFTP 都没有条件写入，写入后等待 settle_seconds 再读回确认归属；极少数情况下两个进程
+    同时领取同一分片，两者的结果相同，只是浪费一份计算。租约依赖各机器的时钟大致同步。
+    """
+
+    def __init__(self, repo, job_prefix: str, owner: str, lease_seconds: float = 600, settle_seconds: float = 1.0):
+        super().__init__(owner, lease_seconds)
+        self.repo = repo
+        self.job_prefix = job_prefix
+        self.settle_seconds = settle_seconds
+
+    def _path(self, key: str) -> str:
+        return f"{self.job_prefix}/claims/{key}.json"
+
+    def _read(self, key: str) -> Optional[Dict]:
+        text = self.repo.read_text(self._path(key))
+        return json.loads(text) if text else None
+
+    def _write(self, key: str, lease: Dict):
+        self.repo.write_text(self._path(key), json.dumps(lease))
+
+    def claim(self, key: str) -> bool:
+        if not self._available(self._read(key)):
+            return False
+        self._write(key, self._lease())
+        time.sleep(self.settle_seconds)
+        return self._owned(self._read(key))
+
+    def renew(self, key: str) -> bool:
+        if not self._owned(self._read(key)):
+            return False
+        self._write(key, self._lease())
+        return True
+
+    def complete(self, key: str):
+        self._write(key, self._lease("done"))
+
+    def is_done(self, key: str) -> bool:
+        lease = self._read(key)
+        return lease is not None and lease["state"] == "done"
+
+
+def make_coordinator(spec: JobSpec, repo, owner: str) -> Coordinator:
+    if spec.coordinator == "repo":
+        return RepoCoordinator(repo, spec.job_prefix, owner, spec.lease_seconds)
+    return LocalCoordinator(spec.coordinator, owner, spec.lease_seconds)
+
+
+def plan_job(repo, spec: JobSpec) -> Dict:
+    """递归列举 prefix 一次，按 crc32 写出各分片清单，最后写入 plan.json
+
+    列举结果中的大小和 ETag 一并写入清单，处理时直接用于对象缓存的版本判断，不再逐个 stat。
+    """
+    extensions = tuple(ext.lower() for ext in spec.extensions)
+    shards: List[List[str]] = [[] for _ in range(spec.n_shards)]
+    n_objects = 0
+    for entry in repo.iter_directory(spec.prefix, recursive=True):
+        name = repo.entry_name(entry)
+        if name.lower().endswith(extensions):
+            remote_entry = repo.listing_entry(entry)
+            line = remote_entry._asdict() if remote_entry is not None else {"name": name}
+            shards[shard_of(name, spec.n_shards)].append(json.dumps(line, ensure_ascii=False))
+            n_objects += 1
+    for shard, lines in enumerate(shards):
+        repo.write_text(spec.manifest(shard), "\n".join(lines))
+    plan = {"prefix": spec.prefix, "n_shards": spec.n_shards, "objects": n_objects,
+            "shard_sizes": [len(lines) for lines in shards], "created": time.time()}
+    repo.write_text(spec.plan, json.dumps(plan))
+    logger.info(f"planned {n_objects} objects from {spec.prefix} into {spec.n_shards} shards")
+    return plan
+
+
+def ensure_plan(repo, coordinator: Coordinator, spec: JobSpec) -> Dict:
+    """只有领取到 plan 租约的进程列举，其他进程等待 plan.json 出现"""
+    while True:
+        text = repo.read_text(spec.plan)
+        if text:
+            plan = json.loads(text)
+            if plan["n_shards"] != spec.n_shards or plan["prefix"] != spec.prefix:
+                raise RuntimeError(f"{spec.job_prefix} was planned for {plan['prefix']} with "
+                                   f"{plan['n_shards']} shards, use another job prefix")
+            return plan
+        if coordinator.claim(PLAN_KEY):
+            plan = plan_job(repo, spec)
+            coordinator.complete(PLAN_KEY)
+            return plan
+        time.sleep(5)
+
+
+def _load_checkpoint(repo, spec: JobSpec, shard: int) -> List[str]:
+    """之前进程留下的检查点中成功的记录；失败的对象重新分析"""
+    text = repo.read_text(spec.partial(shard))
+    if not text:
+        return []
+    lines = []
+    for line in text.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # 只可能是最后一行写了一半
+            continue
+        if "error" not in record:
+            lines.append(line)
+    return lines
+
+
+def _load_manifest(repo, spec: JobSpec, shard: int) -> List[RemoteEntry]:
+    entries = []
+    for line in (repo.read_text(spec.manifest(shard)) or "").splitlines():
+        if line:
+            item = json.loads(line)
+            # SFTP 的列举只有对象名
+            entries.append(RemoteEntry(**item) if len(item) > 1 else RemoteEntry(item["name"], None, None, None))
+    return entries
+
+
+def _fetch(repo, entry: RemoteEntry, tmp_dir: str) -> str:
+    """启用对象缓存时返回缓存中的文件，否则下载到 tmp_dir
+
+    清单中有列举元数据时缓存不再 stat；没有缓存时 retrieve_file 自身仍会做一次存在性检查。
+    """
+    name = entry.name
+    if repo.object_cache is not None:
+        return repo.cached_file(name, entry if entry.size is not None else None)
+    local_file = os.path.join(tmp_dir, f"{zlib.crc32(name.encode('utf-8')):08x}_{os.path.basename(name)}")
+    repo.retrieve_file(name, local_file)
+    return local_file
+
+
+class ShardLost(RuntimeError):
+    """续约失败，分片已被其他进程接手"""
+
+
+class ShardRunner:
+    """一个工作进程：加载一次分析器，循环领取分片并处理
+
+    read(本地文件) 在读取线程中执行，返回交给 analyze 的数据；analyze(数据) 在主线程中执行，返回人脸列表。
+    默认分别为 read_image 和 analyze_data，owner 固定时重启的进程可以立即接回自己的租约。
+    """
+
+    def __init__(self, spec: JobSpec, owner: str = None, read: Callable[[str], object] = None,
+                 analyze: Callable[[object], List[Dict]] = None):
+        self.spec = spec
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.repo = get_data_repo(spec.repo_cfg)
+        self.coordinator = make_coordinator(spec, self.repo, self.owner)
+        if read is None or analyze is None:
+            batch_size = cfg.batch_size if spec.batch_size is None else spec.batch_size
+            fix_img_size = cfg.fix_img_size if spec.fix_img_size is None else spec.fix_img_size
+            analyzer = get_analyzer()
+            stage = make_predictor_stage(analyzer, batch_size=batch_size)
+            read = read or (lambda path: read_image(analyzer, path, fix_img_size))
+            analyze = analyze or (lambda data: [face_to_dict(face) for face in analyze_data(
+                analyzer, data, batch_size=batch_size, batcher=stage).faces])
+        self.read = read
+        self.analyze = analyze
+        self.stats = {"shards": 0, "images": 0, "skipped": 0, "faces": 0, "errors": 0, "lost": 0}
+
+    def run(self) -> Dict:
+        plan = ensure_plan(self.repo, self.coordinator, self.spec)
+        # 各进程从不同的分片开始，减少争抢同一租约
+        offset = zlib.crc32(self.owner.encode("utf-8")) % self.spec.n_shards
+        order = [(offset + i) % self.spec.n_shards for i in range(self.spec.n_shards)]
+        order = [shard for shard in order if plan["shard_sizes"][shard] > 0]
+        while order:
+            order = [shard for shard in order if not self.coordinator.is_done(shard_name(shard))]
+            claimed = False
+            for shard in order:
+                if self.coordinator.claim(shard_name(shard)):
+                    claimed = True
+                    try:
+                        self.run_shard(shard)
+                    except ShardLost:
+                        self.stats["lost"] += 1
+                        logger.warning(f"{self.owner} lost the lease of {shard_name(shard)}")
+            if not claimed and order:
+                if not self.spec.wait:
+                    break
+                time.sleep(min(self.spec.lease_seconds / 2, 30))
+        logger.info(f"{self.owner} finished: {self.stats}")
+        return self.stats
+
+    def run_shard(self, shard: int):
+        spec = self.spec
+        key = shard_name(shard)
+        entries = _load_manifest(self.repo, spec, shard)
+        done_lines = _load_checkpoint(self.repo, spec, shard)
+        done = {json.loads(line)["path"] for line in done_lines}
+        todo = [entry for entry in entries if entry.name not in done]
+        self.stats["skipped"] += len(entries) - len(todo)
+        logger.info(f"{self.owner} running {key}: {len(todo)} of {len(entries)} objects left")
+
+        with tempfile.TemporaryDirectory() as tmp_dir, ThreadPoolExecutor(max_workers=spec.read_workers) as pool:
+            path_results = os.path.join(tmp_dir, f"{key}.jsonl")
+            downloads = os.path.join(tmp_dir, "objects")
+            os.makedirs(downloads)
+
+            def load(entry):
+                local_file = _fetch(self.repo, entry, downloads)
+                try:
+                    return self.read(local_file)
+                finally:
+                    if local_file.startswith(downloads):
+                        os.remove(local_file)
+
+            with open(path_results, "w", encoding="utf-8") as out:
+                out.writelines(line + "\n" for line in done_lines)
+                pending = deque()
+                entries_iter = iter(todo)
+
+                def submit_next():
+                    entry = next(entries_iter, None)
+                    if entry is not None:
+                        pending.append((entry.name, pool.submit(load, entry)))
+
+                for _ in range(spec.prefetch):
+                    submit_next()
+                since_checkpoint, last_checkpoint = 0, time.monotonic()
+                while pending:
+                    name, future = pending.popleft()
+                    submit_next()
+                    record = {"path": name}
+                    try:
+                        record["faces"] = self.analyze(future.result())
+                        self.stats["faces"] += len(record["faces"])
+                    except Exception as e:
+                        logger.error(f"failed to analyze {name}: {e}")
+                        record["error"] = str(e)
+                        self.stats["errors"] += 1
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    self.stats["images"] += 1
+                    since_checkpoint += 1
+                    if (since_checkpoint >= spec.checkpoint_every
+                            or time.monotonic() - last_checkpoint >= spec.checkpoint_seconds):
+                        out.flush()
+                        self._checkpoint(key, spec.partial(shard), path_results)
+                        since_checkpoint, last_checkpoint = 0, time.monotonic()
+
+            if not self.coordinator.renew(key):
+                raise ShardLost(key)
+            self.repo.store_file(remote_path=spec.result(shard), local_file=path_results)
+        self.coordinator.complete(key)
+        if self.repo.stat_entry(spec.partial(shard)) is not None:
+            self.repo.delete_file(spec.partial(shard))
+        self.stats["shards"] += 1
+
+    def _checkpoint(self, key: str, remote_path: str, path_results: str):
+        # 先续约再上传，租约已被接手时不覆盖对方的检查点
+        if not self.coordinator.renew(key):
+            raise ShardLost(key)
+        self.repo.store_file(remote_path=remote_path, local_file=path_results)
+
+
+def run_worker(spec: JobSpec, cores: List[int] = None) -> Dict:
+    if cores:
+        import torch
+
+        # 与 serving 的工作进程相同：绑定分到的核心，进程之间不争抢线程
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+    return ShardRunner(spec).run()
+
+
+def run_job(spec: JobSpec, processes: int = 1) -> Dict:
+    """本机启动 processes 个工作进程；其他机器用相同的 spec 运行即可加入同一任务"""
+    if processes <= 1:
+        return run_worker(spec)
+    from serving import split_cores
+
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(processes) as pool:
+        results = pool.starmap(run_worker, [(spec, cores) for cores in split_cores(processes)])
+    stats = {key: sum(result[key] for result in results) for key in results[0]}
+    logger.info(f"job {spec.job_prefix} finished on this machine: {stats}")
+    return stats
+
+
+def collect_results(spec: JobSpec, path_output: str) -> int:
+    """把已完成分片的结果合并为一个本地 JSONL 文件，返回合并的分片数"""
+    repo = get_data_repo(spec.repo_cfg)
+    n_shards = 0
+    with open(path_output, "w", encoding="utf-8") as out:
+        for shard in range(spec.n_shards):
+            text = repo.read_text(spec.result(shard))
+            if text:
+                out.write(text if text.endswith("\n") else text + "\n")
+                n_shards += 1
+    return n_shards
+
+
+if __name__ == "__main__":
+    job_cfg = cfg.bulk_job
+    parser = argparse.ArgumentParser(description="对象存储前缀的分片批量人脸分析")
+    parser.add_argument("prefix", help="要分析的远端目录或前缀")
+    parser.add_argument("--job-prefix", default=None, help="清单、租约和结果的存放位置，默认 jobs/<prefix>")
+    parser.add_argument("--shards", type=int, default=job_cfg.n_shards, help="分片数，同一任务的所有进程必须相同")
+    parser.add_argument("--processes", type=int, default=job_cfg.processes, help="本机工作进程数")
+    parser.add_argument("--coordinator", default=job_cfg.coordinator, help="repo 或本地协调文件路径")
+    parser.add_argument("--repo-cfg", default=CFG_PATH, help="filemanager 配置文件，storage=local 时使用本地目录")
+    parser.add_argument("--collect", default=None, help="不运行分析，只把已完成的分片结果合并到该 JSONL 文件")
+    args = parser.parse_args()
+
+    job_spec = JobSpec(prefix=args.prefix, job_prefix=args.job_prefix or f"jobs/{args.prefix.strip('/')}",
+                       n_shards=args.shards, repo_cfg=os.path.abspath(args.repo_cfg), coordinator=args.coordinator,
+                       lease_seconds=job_cfg.lease_seconds, checkpoint_every=job_cfg.checkpoint_every,
+                       checkpoint_seconds=job_cfg.checkpoint_seconds, read_workers=job_cfg.read_workers,
+                       prefetch=job_cfg.prefetch)
+    if args.collect:
+        logger.info(f"collected {collect_results(job_spec, args.collect)} shards into {args.collect}")
+    else:
+        logger.info(json.dumps(run_job(job_spec, processes=args.processes)))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : encoding.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 紧凑的响应编码：元数据为 JSON，嵌入向量为 base64 float16 或二进制附件，图像为 JPEG/PNG，张量只在需要时输出
+"""
+
+import base64
+import json
+import struct
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import torch
+import torchvision
+from facetorch.datastruct import ImageData, Response
+
+from logging_utils import truncate
+
+# logits 元素数超过该值视为嵌入向量，否则直接以数值列表输出（分类分数）
+EMBEDDING_MIN_SIZE = 64
+
+
+class _Writer:
+    """base64 模式下数据内联在 JSON 中，binary 模式下放入附件，JSON 中只记录偏移和长度"""
+
+    def __init__(self, binary: bool):
+        self.binary = binary
+        self.attachments: List[bytes] = []
+        self.offset = 0
+
+    def blob(self, data: bytes, **meta) -> Dict:
+        if not self.binary:
+            return {**meta, "base64": base64.b64encode(data).decode("ascii")}
+        entry = {**meta, "offset": self.offset, "length": len(data)}
+        self.attachments.append(data)
+        self.offset += len(data)
+        return entry
+
+    def array(self, tensor: torch.Tensor, dtype=np.float16) -> Dict:
+        array = tensor.detach().cpu().numpy().astype(dtype, copy=False)
+        return self.blob(array.tobytes(), dtype=np.dtype(dtype).name, shape=list(array.shape))
+
+
+def _encode_image(img: torch.Tensor, image_format: str, quality: int) -> bytes:
+    if img.dtype != torch.uint8:
+        img = (img.clamp(0, 1) * 255).to(torch.uint8) if img.is_floating_point() else img.to(torch.uint8)
+    img = img.cpu()
+    if image_format == "png":
+        return torchvision.io.encode_png(img).numpy().tobytes()
+    return torchvision.io.encode_jpeg(img, quality=quality).numpy().tobytes()
+
+
+def _encode_faces(response: Response, writer: _Writer, embeddings: bool, include_tensors: bool) -> List[Dict]:
+    faces = []
+    for face in response.faces:
+        preds = {}
+        for name, pred in face.preds.items():
+            entry = {"label": pred.label}
+            entry.update({key: value for key, value in pred.other.items() if isinstance(value, (str, int, float))})
+            logits = pred.logits
+            if isinstance(logits, torch.Tensor) and logits.numel() > 0:
+                if logits.numel() > EMBEDDING_MIN_SIZE:
+                    if embeddings:
+                        entry["embedding"] = writer.array(logits.flatten())
+                else:
+                    entry["scores"] = [round(value, 4) for value in logits.flatten().float().tolist()]
+            preds[name] = entry
+        item = {"indx": face.indx, "loc": face.loc.__dict__, "dims": face.dims.__dict__, "preds": preds}
+        if include_tensors and isinstance(face.tensor, torch.Tensor) and face.tensor.numel() > 0:
+            item["tensor"] = writer.array(face.tensor)
+        faces.append(item)
+    return faces
+
+
+def _encode(response: Union[Response, ImageData], binary: bool, embeddings: bool, image_format: str,
+            include_tensors: bool, quality: int) -> Tuple[Dict, List[bytes]]:
+    writer = _Writer(binary)
+    meta = {"version": response.version, "faces": _encode_faces(response, writer, embeddings, include_tensors)}
+    img = getattr(response, "img", None)
+    if image_format and isinstance(img, torch.Tensor) and img.numel() > 0:
+        meta["image"] = writer.blob(_encode_image(img, image_format, quality), format=image_format,
+                                    shape=list(img.shape))
+    return meta, writer.attachments
+
+
+def encode_response(response: Union[Response, ImageData], embeddings: bool = True, image_format: str = None,
+                    include_tensors: bool = False, quality: int = 90) -> Dict:
+    """可直接序列化为 JSON 的字典，二进制数据内联为 base64"""
+    return _encode(response, False, embeddings, image_format, include_tensors, quality)[0]
+
+
+def encode_binary(response: Union[Response, ImageData], embeddings: bool = True, image_format: str = "jpeg",
+                  include_tensors: bool = False, quality: int = 90) -> bytes:
+    """4 字节大端 JSON 长度 + JSON 元数据 + 附件；元数据中的 offset 相对附件起始位置"""
+    meta, attachments = _encode(response, True, embeddings, image_format, include_tensors, quality)
+    header = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return b"".join([struct.pack(">I", len(header)), header, *attachments])
+
+
+def decode_binary(payload: bytes) -> Tuple[Dict, bytes]:
+    """返回 (元数据, 附件区)，配合 read_blob 取出具体数据"""
+    (length,) = struct.unpack(">I", payload[:4])
+    return json.loads(payload[4:4 + length].decode("utf-8")), payload[4 + length:]
+
+
+def read_blob(entry: Dict, attachments: bytes = None) -> bytes:
+    if "base64" in entry:
+        return base64.b64decode(entry["base64"])
+    return attachments[entry["offset"]:entry["offset"] + entry["length"]]
+
+
+def read_array(entry: Dict, attachments: bytes = None) -> np.ndarray:
+    return np.frombuffer(read_blob(entry, attachments), dtype=entry["dtype"]).reshape(entry["shape"])
+
+
+def summarize_response(response: Union[Response, ImageData], max_chars: int = 2000) -> str:
+    """日志用的简短摘要：人脸数和各预测器标签，不包含张量，超过 max_chars 截断"""
+    labels = {face.indx: {name: pred.label for name, pred in face.preds.items()} for face in response.faces}
+    return truncate(f"version={response.version} faces={len(response.faces)} labels={labels}", max_chars)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : gallery.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 人脸嵌入向量底库，支持内存映射存储、批量 top-k 检索、增量增删与保存加载
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from facetorch.datastruct import Response
+from loguru import logger
+
+EMBED_PREDICTORS = ("verify", "embed")
+MATRIX_FILE = "embeddings.npy"
+META_FILE = "meta.json"
+LOG_FILE = "changes.jsonl"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _replay(ids: List[Optional[str]], path_log: str, repair: bool = True) -> List[Optional[str]]:
+    """在元数据的 id 列表上按顺序重放变更日志；每条变更只设置一行，重复重放结果不变
+
+    写到一半退出会留下不完整的最后一行，repair 为 True 时截掉它，之后追加的变更才能被读到。
+    """
+    if not os.path.exists(path_log):
+        return ids
+    with open(path_log, "rb") as f:
+        content = f.read()
+    n_good = 0
+    for line in content.splitlines(keepends=True):
+        try:
+            change = json.loads(line) if line.endswith(b"\n") else None
+        except ValueError:
+            change = None
+        if change is None:
+            break
+        row = change["row"]
+        if row >= len(ids):
+            ids.extend([None] * (row + 1 - len(ids)))
+        ids[row] = change.get("add")
+        n_good += len(line)
+    if repair and n_good < len(content):
+        logger.warning(f"drop incomplete tail of face gallery log {path_log}")
+        with open(path_log, "r+b") as f:
+            f.truncate(n_good)
+    return ids
+
+
+def response_embeddings(response: Response, predictor_name: str = "verify") -> Tuple[List[int], np.ndarray]:
+    """取出响应中每张人脸指定预测器的 logits，返回 (人脸序号, 向量矩阵)"""
+    faces = [face for face in response.faces if predictor_name in face.preds]
+    if not faces:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    logits = torch.stack([face.preds[predictor_name].logits.detach().float().cpu() for face in faces])
+    return [face.indx for face in faces], logits.numpy()
+
+
+class FaceGallery:
+    """人脸底库
+
+    向量归一化后保存在内存映射矩阵中（float32 或 float16），检索时按块做矩阵乘法，
+    删除时只打标记并复用空行，容量不足时按倍数扩容。
+    每次增删后先刷新矩阵，再把变更（身份名称和所在行）追加到变更日志，耗时只与本次变更的数量有关；
+    加载时在元数据之后重放日志，save 写出完整的元数据并清空日志。
+    """
+
+    def __init__(self, path: str, dim: int, dtype: str = "float16", capacity: int = 1024,
+                 chunk_rows: int = 65536):
+        if dtype not in ("float16", "float32"):
+            raise ValueError(f"unsupported gallery dtype: {dtype}")
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self._ids: List[Optional[str]] = []
+        self._row_of: Dict[str, int] = {}
+        self._free: List[int] = []
+        os.makedirs(path, exist_ok=True)
+        self._matrix = np.lib.format.open_memmap(os.path.join(path, MATRIX_FILE), mode="w+",
+                                                 dtype=self.dtype, shape=(max(capacity, 1), dim))
+        self._valid = np.zeros(self._matrix.shape[0], dtype=bool)
+        # 新建时就写出元数据，之后的变更都追加在日志中
+        self.save()
+
+    @classmethod
+    def load(cls, path: str, chunk_rows: int = 65536, mode: str = "r+") -> "FaceGallery":
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        gallery = cls.__new__(cls)
+        gallery.path = path
+        gallery.dim = meta["dim"]
+        gallery.dtype = np.dtype(meta["dtype"])
+        gallery.chunk_rows = chunk_rows
+        gallery._matrix = np.load(os.path.join(path, MATRIX_FILE), mmap_mode=mode)
+        gallery._ids = _replay(meta["ids"], os.path.join(path, LOG_FILE), repair=mode != "r")
+        gallery._row_of = {face_id: row for row, face_id in enumerate(gallery._ids) if face_id is not None}
+        gallery._free = [row for row, face_id in enumerate(gallery._ids) if face_id is None]
+        gallery._valid = np.zeros(gallery._matrix.shape[0], dtype=bool)
+        gallery._valid[list(gallery._row_of.values())] = True
+        logger.info(f"load face gallery from {path}: {len(gallery)} identities")
+        return gallery
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, META_FILE))
+
+    @classmethod
+    def open(cls, path: str, dim: int = None, dtype: str = "float16", chunk_rows: int = 65536) -> "FaceGallery":
+        """底库存在则加载，否则按给定维度新建"""
+        if cls.exists(path):
+            return cls.load(path, chunk_rows=chunk_rows)
+        if dim is None:
+            raise RuntimeError(f"face gallery {path} does not exist, dim is required to create it")
+        return cls(path, dim=dim, dtype=dtype, chunk_rows=chunk_rows)
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, face_id: str) -> bool:
+        return face_id in self._row_of
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self._row_of)
+
+    def _grow(self, n_rows: int):
+        capacity = self._matrix.shape[0]
+        if n_rows <= capacity:
+            return
+        new_capacity = max(n_rows, capacity * 2)
+        tmp_path = os.path.join(self.path, MATRIX_FILE + ".tmp")
+        matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=(new_capacity, self.dim))
+        matrix[:capacity] = self._matrix
+        matrix.flush()
+        del self._matrix
+        os.replace(tmp_path, os.path.join(self.path, MATRIX_FILE))
+        self._matrix = np.load(os.path.join(self.path, MATRIX_FILE), mmap_mode="r+")
+        self._valid = np.concatenate([self._valid, np.zeros(new_capacity - capacity, dtype=bool)])
+        logger.debug(f"face gallery capacity {capacity} -> {new_capacity}")
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray):
+        """增加或更新身份，已存在的 id 会被覆盖"""
+        vectors = _normalize(vectors)
+        if len(ids) != vectors.shape[0]:
+            raise ValueError(f"got {len(ids)} ids for {vectors.shape[0]} vectors")
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"vector dim {vectors.shape[1]} does not match gallery dim {self.dim}")
+        rows = []
+        for face_id in ids:
+            if face_id in self._row_of:
+                row = self._row_of[face_id]
+            elif self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._ids)
+                self._ids.append(None)
+            self._ids[row] = face_id
+            self._row_of[face_id] = row
+            rows.append(row)
+        self._grow(len(self._ids))
+        rows = np.asarray(rows)
+        self._matrix[rows] = vectors.astype(self.dtype)
+        self._valid[rows] = True
+        self._log([{"add": face_id, "row": int(row)} for face_id, row in zip(ids, rows)])
+
+    def remove(self, ids: Iterable[str]) -> int:
+        changes = []
+        for face_id in ids:
+            row = self._row_of.pop(face_id, None)
+            if row is None:
+                continue
+            self._ids[row] = None
+            self._valid[row] = False
+            self._matrix[row] = 0
+            self._free.append(row)
+            changes.append({"remove": face_id, "row": row})
+        self._log(changes)
+        return len(changes)
+
+    def search(self, queries: np.ndarray, k: int = 5) -> List[List[Tuple[str, float]]]:
+        """批量检索，每个查询向量返回按相似度降序的 [(id, 余弦相似度)]"""
+        queries = _normalize(queries)
+        n_rows = len(self._ids)
+        k = min(k, len(self))
+        if k == 0:
+            return [[] for _ in range(queries.shape[0])]
+        best_scores = np.full((queries.shape[0], 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        for start in range(0, n_rows, self.chunk_rows):
+            end = min(start + self.chunk_rows, n_rows)
+            valid = self._valid[start:end]
+            if not valid.any():
+                continue
+            scores = queries @ np.asarray(self._matrix[start:end], dtype=np.float32).T
+            scores[:, ~valid] = -np.inf
+            rows = np.broadcast_to(np.arange(start, end), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            kk = min(k, scores.shape[1])
+            top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [[(self._ids[row], float(score)) for row, score in zip(rows, scores) if np.isfinite(score)]
+                for rows, scores in zip(best_rows, best_scores)]
+
+    def _log(self, changes: List[Dict]):
+        if not changes:
+            return
+        # 日志引用的行必须已经写入磁盘，先刷新矩阵
+        self._matrix.flush()
+        with open(os.path.join(self.path, LOG_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(change, ensure_ascii=False) + "\n" for change in changes))
+
+    def save(self):
+        """写出完整的元数据并清空变更日志；两步之间退出时，重放日志得到的结果相同"""
+        self._matrix.flush()
+        meta = {"dim": self.dim, "dtype": self.dtype.name, "count": len(self), "ids": self._ids}
+        tmp_path = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+        if os.path.exists(os.path.join(self.path, LOG_FILE)):
+            os.remove(os.path.join(self.path, LOG_FILE))
+        logger.info(f"save face gallery to {self.path}: {len(self)} identities")
+
+    def add_response(self, response: Response, ids: Sequence[str], predictor_name: str = "verify"):
+        """把一次推理结果中的人脸按顺序登记到底库"""
+        _, vectors = response_embeddings(response, predictor_name)
+        self.add(ids, vectors)
+
+    def search_response(self, response: Response, predictor_name: str = "verify",
+                        k: int = 5) -> Dict[int, List[Tuple[str, float]]]:
+        """把一次推理结果中的每张人脸与底库比对，返回 {人脸序号: top-k 结果}"""
+        indices, vectors = response_embeddings(response, predictor_name)
+        if not indices:
+            return {}
+        return dict(zip(indices, self.search(vectors, k=k)))
@@ -7,14 +7,29 @@
 @Desc    :   
 """
 from abc import abstractmethod, ABCMeta
-from typing import List
+from collections import namedtuple
+from concurrent.futures import Future
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+import os
+import tempfile
 
+from .listing_cache import ListingCache
+from .object_cache import ObjectCache, parse_cache_config
 
-class DataRepo:
-    __metaclass__ = ABCMeta
+# Metadata of one remote file; etag is None for backends that do not provide one.
+RemoteEntry = namedtuple('RemoteEntry', ['name', 'size', 'etag', 'mtime'])
+
+
+class DataRepo(metaclass=ABCMeta):
 
     def __init__(self, cp):
         self.cp = cp
+        # listings may be up to listingCacheTtl seconds stale with respect to other writers
+        ttl = cp.getfloat('control', 'listingCacheTtl', fallback=0)
+        self.listing_cache = ListingCache(ttl) if ttl > 0 else None
+        cache_config = parse_cache_config(cp)
+        self.object_cache = ObjectCache(**cache_config) if cache_config["cache_dir"] else None
 
     def open_file(self, path: str):
         pass
@@ -46,6 +61,99 @@ class DataRepo:
     def list_directory(self, remote_path: str) -> List:
         pass
 
+    @abstractmethod
+    def list_entries(self, remote_path: str) -> List[RemoteEntry]:
+        pass
+
+    @abstractmethod
+    def iter_directory(self, remote_path: str, recursive: bool = False, start_after: str = None) -> Iterator:
+        pass
+
+    def entry_name(self, entry) -> str:
+        return entry
+
+    def listing_entry(self, entry) -> Optional[RemoteEntry]:
+        """Metadata carried by a listing entry, None for backends whose listings only yield names."""
+        return None
+
+    def list_page(self, remote_path: str, page_size: int = 100,
+                  start_after: str = None) -> Tuple[List, Optional[str]]:
+        """Return one page of a listing and the token to pass as start_after for the next page."""
+        key = ('page', remote_path, page_size, start_after)
+        page = self._cached_listing(key)
+        if page is None:
+            items = list(islice(self.iter_directory(remote_path, start_after=start_after), page_size + 1))
+            next_token = self.entry_name(items[page_size - 1]) if len(items) > page_size else None
+            page = (items[:page_size], next_token)
+            self._cache_listing(key, remote_path, page)
+        return page
+
+    def _cached_listing(self, key):
+        return self.listing_cache.get(key) if self.listing_cache is not None else None
+
+    def _cache_listing(self, key, remote_path: str, value):
+        if self.listing_cache is not None:
+            self.listing_cache.put(key, remote_path or '', value)
+
+    def _invalidate_listing(self, remote_path: str):
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(remote_path)
+
+    @abstractmethod
+    def stat_entry(self, remote_path: str) -> Optional[RemoteEntry]:
+        """Metadata of a single remote file, None if it is not a file."""
+        pass
+
+    @abstractmethod
+    def _download(self, remote_path: str, local_file: str):
+        pass
+
+    def cached_file(self, remote_path: str, entry: RemoteEntry = None) -> str:
+        """Local path of the current version of a remote file, downloaded into the object cache on a miss.
+
+        Pass the entry from a listing to skip the stat round trip.
+        """
+        return self.object_cache.get(*self._cache_args(remote_path, entry))
+
+    def _retrieve_cached(self, remote_path: str, local_file: str, entry: RemoteEntry = None):
+        # copy rather than link: callers may modify their local file
+        self.object_cache.copy(*self._cache_args(remote_path, entry), local_file)
+
+    def _open_cached(self, remote_path: str):
+        return self.object_cache.open(*self._cache_args(remote_path))
+
+    def _cache_args(self, remote_path: str, entry: RemoteEntry = None):
+        entry = entry or self.stat_entry(remote_path)
+        if entry is None:
+            raise RuntimeError('Please provide file path instead of directory')
+        # the ETag changes with the content; backends without one fall back to size and mtime
+        version = entry.etag.strip('"') if entry.etag else f'{entry.size}-{entry.mtime}'
+        return remote_path, version, lambda tmp_path: self._download(remote_path, tmp_path)
+
+    def read_text(self, remote_path: str) -> Optional[str]:
+        """Read a small control file (job plans, leases), bypassing the object cache; None if it does not exist."""
+        if self.stat_entry(remote_path) is None:
+            return None
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_file = os.path.join(tmp_dir, 'object')
+            self._download(remote_path, local_file)
+            with open(local_file, 'r', encoding='utf-8') as f:
+                return f.read()
+
+    def write_text(self, remote_path: str, text: str):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_file = os.path.join(tmp_dir, 'object')
+            with open(local_file, 'w', encoding='utf-8') as f:
+                f.write(text)
+            # keywords: the SFTP repo takes (local_file, remote_path) positionally
+            return self.store_file(remote_path=remote_path, local_file=local_file)
+
+    def prefetch(self, remote_paths: Iterable[str]) -> List[Future]:
+        """Hint that these files will be read soon: download them into the object cache in the background."""
+        if self.object_cache is None:
+            return []
+        return [self.object_cache.submit(remote_path, self.cached_file, remote_path) for remote_path in remote_paths]
+
     def _is_directory(self, remote_path: str):
         listing = self.list_directory(remote_path)
         return len(listing) > 0
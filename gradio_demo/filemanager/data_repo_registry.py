@@ -6,16 +6,22 @@
 @Date    :   2021/2/8
 @Desc    :   
 """
+from .local_data_repo import LocalDataRepo
 from .minio_data_repo import MinIODataRepo
 from .sftp_data_repo import SFTPDataRepo
 from configparser import ConfigParser
 from pathlib import Path
+import threading
 
 
 class DataRepoRegistry:
     def __init__(self):
         self._registry = {}
         self.cfg_path = ''
+        # Repo instances are shared between callers and threads: the MinIO client
+        # is thread-safe and SFTP access goes through a connection pool.
+        self._instances = {}
+        self._lock = threading.Lock()
 
     def register(self, store_type, repo):
         self._registry[store_type] = repo
@@ -23,22 +29,36 @@ class DataRepoRegistry:
     def set_cfg_path(self, cfg_path):
         self.cfg_path = cfg_path
 
-    def get_data_repo(self):
-        cp = ConfigParser()
-        # cp.read(Path(__file__).parent.parent.parent.joinpath("config.cfg").resolve(), encoding='utf-8')
-        cp.read(self.cfg_path, encoding='utf-8')
-        store_type = cp.get('control', 'storage')
-        if store_type is None:
-            raise RuntimeError('store type not found in config.cfg')
-        return self._registry[store_type](cp)
+    def get_data_repo(self, cfg_path=None):
+        cfg_path = str(Path(cfg_path or self.cfg_path).resolve())
+        repo = self._instances.get(cfg_path)
+        if repo is not None:
+            return repo
+        with self._lock:
+            if cfg_path not in self._instances:
+                cp = ConfigParser()
+                # cp.read(Path(__file__).parent.parent.parent.joinpath("config.cfg").resolve(), encoding='utf-8')
+                cp.read(cfg_path, encoding='utf-8')
+                store_type = cp.get('control', 'storage')
+                if store_type is None:
+                    raise RuntimeError('store type not found in config.cfg')
+                self._instances[cfg_path] = self._registry[store_type](cp)
+            return self._instances[cfg_path]
+
+    def reset(self):
+        with self._lock:
+            instances, self._instances = self._instances, {}
+        for repo in instances.values():
+            if hasattr(repo, 'pool'):
+                repo.pool.close()
 
 
 _data_repo_registry = DataRepoRegistry()
 
 _data_repo_registry.register('minio', MinIODataRepo)
 _data_repo_registry.register('sftp', SFTPDataRepo)
+_data_repo_registry.register('local', LocalDataRepo)
 
 
 def get_data_repo(cfg_path):
-    _data_repo_registry.set_cfg_path(cfg_path)
-    return _data_repo_registry.get_data_repo()
+    return _data_repo_registry.get_data_repo(cfg_path)
@@ -3,6 +3,7 @@ import os
 import shutil
 import fnmatch
 from .data_repo_registry import get_data_repo
+from .sync import push_directory
 
 CFG_PATH = os.path.join(os.path.dirname(__file__), "config.cfg")
 
@@ -17,6 +18,12 @@ class FileManager:
         files = self.data_repo.list_directory(path)
         return files
 
+    def iter_directory(self, path: str, recursive: bool = False):
+        return self.data_repo.iter_directory(path, recursive=recursive)
+
+    def list_page(self, path: str, page_size: int = 100, start_after: str = None):
+        return self.data_repo.list_page(path, page_size=page_size, start_after=start_after)
+
     def create_directory(self, path: str):
         self.data_repo.create_directory(path)
 
@@ -32,8 +39,14 @@ class FileManager:
     def delete_file(self, path: str, filename: str):
         self.data_repo.delete_file(path, filename)
 
-    def get_object(self, remote_path):
-        return self.data_repo.get_object(remote_path)
+    def prefetch(self, remote_paths):
+        return self.data_repo.prefetch(remote_paths)
+
+    def get_object(self, remote_path, use_cache: bool = False):
+        return self.data_repo.get_object(remote_path, use_cache=use_cache)
+
+    def read_object(self, remote_path, use_cache: bool = False) -> bytes:
+        return self.data_repo.read_object(remote_path, use_cache=use_cache)
 
     def get_object_url(self, remote_path):
         return self.data_repo.get_object_url(remote_path)
@@ -59,19 +72,9 @@ class FileManager:
             self.data_repo.store_file(os.path.join(det_path, os.path.basename(src_path)), src_path)
             print('{}--->>>{}'.format(src_path, det_path))
 
-    def push_data(self, src_path: str, det_path: str):  # 将文件增量上传
-        srcs = os.listdir(src_path)
-        srcs = list(filter(lambda x: x.endswith('mp4'), srcs))
-        dets = self.list_remote(det_path)
-        diff_adds = list(set(srcs).difference(set(dets)))
-        diff_dels = list(set(dets).difference(set(srcs)))
-
-        for add_item in diff_adds:
-            self.data_repo.store_file(os.path.join(det_path, add_item), os.path.join(src_path, add_item))
-            print('{}--->>>{}'.format(src_path, det_path))
-
-        for del_item in diff_dels:
-            self.data_repo.delete_file(os.path.join(det_path, del_item))
+    def push_data(self, src_path: str, det_path: str, dry_run: bool = False, workers: int = 4,
+                  pattern: str = '*.mp4'):  # 将文件增量上传，内容有变化的文件也会重新上传
+        return push_directory(self.data_repo, src_path, det_path, pattern=pattern, dry_run=dry_run, workers=workers)
 
     # local operate functions
     def label2det(self, src_path: str, det_path: str):
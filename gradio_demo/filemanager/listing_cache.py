@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   listing_cache.py
+@Author  :   yb_li
+@Date    :   2026/10/18
+@Desc    :   Short-TTL cache for remote directory listings
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class ListingCache:
+    """Per-process cache of directory listings.
+
+    Writes made through the same DataRepo invalidate the affected prefixes, but writes from other
+    processes or machines are only seen once the entry expires: the TTL is the only freshness
+    guarantee across processes, so keep it short (a few seconds) or leave it disabled.
+    """
+
+    def __init__(self, ttl: float = 5.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, prefix, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[2]
+
+    def put(self, key, prefix: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, prefix, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path: str):
+        """Drop every cached listing whose prefix contains the changed path."""
+        path = path.replace('\\', '/')
+        with self._lock:
+            for key in [key for key, item in self._entries.items() if path.startswith(item[1])]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   local_data_repo.py
+@Author  :   yb_li
+@Date    :   2026/10/18
+@Desc    :   MinIO-compatible stand-in backed by a local directory, for tests and single-machine jobs
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+import io
+import logging
+import os
+import shutil
+import threading
+
+from .data_repo import DataRepo, RemoteEntry
+from .object_cache import CachedObject
+
+# Same attributes as the minio Object returned by list_objects.
+LocalObject = namedtuple('LocalObject', ['object_name', 'size', 'etag', 'last_modified', 'is_dir'])
+
+
+def local_etag(stat: os.stat_result) -> str:
+    """Opaque version string that changes whenever the file is rewritten, like an ETag."""
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+class LocalDataRepo(DataRepo):
+    """Behaves like MinIODataRepo: object names are '/'-separated keys relative to the root,
+    listings yield objects with object_name/size/etag/last_modified/is_dir, recursive listings
+    are in lexicographic key order and start_after pages through them."""
+
+    def __init__(self, cp):
+        super().__init__(cp)
+        self.logger = logging.getLogger(__name__)
+        self.root = Path(cp.get('local', 'root')).expanduser().resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.logger.info(f"Local repo at {self.root}")
+
+    def _path(self, remote_path: str) -> Path:
+        return self.root / (remote_path or '').replace('\\', '/').lstrip('/')
+
+    def _name(self, path: Path) -> str:
+        return path.relative_to(self.root).as_posix()
+
+    def _object(self, path: Path, stat: os.stat_result = None) -> LocalObject:
+        stat = stat or path.stat()
+        return LocalObject(self._name(path), stat.st_size, local_etag(stat),
+                           datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc), False)
+
+    def store_file(self, remote_path: str, local_file: str, metadata=None):
+        if not Path(local_file).is_file():
+            self.logger.error(f'Error, provided path {local_file} is not a file, please use store_directory instead')
+            raise RuntimeError('Please provide file path instead of directory')
+        target = self._path(remote_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # copy next to the target and rename, readers never see a partial file
+        tmp_path = target.with_name(f'.{target.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        shutil.copyfile(local_file, tmp_path)
+        os.replace(tmp_path, target)
+        self._invalidate_listing(remote_path)
+        return local_etag(target.stat())
+
+    def store_directory(self, remote_path: str, local_dir: str, metadata=None):
+        p = Path(local_dir)
+        if not p.is_dir():
+            self.logger.error(f'Error, provided path {local_dir} is not a directory.')
+            raise RuntimeError('Please provide directory that exists locally')
+        for file in p.rglob("*"):
+            if file.is_file():
+                self.store_file(str(Path(remote_path, file.relative_to(p))), str(file), metadata=metadata)
+
+    def retrieve_file(self, remote_path: str, local_file: str):
+        if not self._path(remote_path).is_file():
+            self.logger.error(
+                f'Error, provided path {remote_path} is not a file, please use retrieve_directory instead')
+            raise RuntimeError('Please provide file path instead of directory')
+        shutil.copyfile(self._path(remote_path), local_file)
+
+    def retrieve_directory(self, remote_path: str, local_dir: str):
+        if not self._path(remote_path).is_dir():
+            self.logger.error(f'Error, provided path {remote_path} does not exist in remote server.')
+            raise RuntimeError('Please provide directory that exists in remote server')
+        shutil.copytree(self._path(remote_path), local_dir, dirs_exist_ok=True)
+
+    def create_directory(self, remote_path: str):
+        self._path(remote_path).mkdir(parents=True, exist_ok=True)
+
+    def delete_file(self, remote_path: str):
+        try:
+            self._path(remote_path).unlink()
+            self._invalidate_listing(remote_path)
+        except FileNotFoundError:
+            self.logger.error(f'Given object {remote_path} does not exist')
+
+    def list_directory(self, remote_path: str):
+        key = ('list', remote_path)
+        objects = self._cached_listing(key)
+        if objects is None:
+            objects = list(self.iter_directory(remote_path))
+            self._cache_listing(key, remote_path, objects)
+        return objects
+
+    def iter_directory(self, remote_path: str, recursive: bool = False, start_after: str = None):
+        """Non-recursive: files and sub-directories (is_dir, name ending in '/'); recursive: files only.
+
+        Children are sorted with directories keyed as 'name/', so a depth-first walk yields keys in the
+        same lexicographic order as MinIO, and subtrees entirely before start_after are skipped.
+        """
+        root = self._path(remote_path)
+        if root.is_dir():
+            yield from self._walk(root, recursive, start_after)
+
+    def _walk(self, directory: Path, recursive: bool, start_after: str = None):
+        with os.scandir(directory) as it:
+            # skip the temporary files of in-flight store_file calls
+            entries = sorted(((self._name(Path(entry.path)) + ('/' if entry.is_dir() else ''), entry) for entry in it
+                              if not (entry.name.startswith('.') and entry.name.endswith('.tmp'))),
+                             key=lambda item: item[0])
+        for name, entry in entries:
+            if entry.is_dir():
+                if not recursive:
+                    if start_after is None or name > start_after:
+                        yield LocalObject(name, 0, None, None, True)
+                elif start_after is None or name > start_after or start_after.startswith(name):
+                    yield from self._walk(Path(entry.path), recursive, start_after)
+            elif start_after is None or name > start_after:
+                yield self._object(Path(entry.path), entry.stat())
+
+    def entry_name(self, entry) -> str:
+        return entry.object_name
+
+    def list_entries(self, remote_path: str):
+        return [self.listing_entry(obj) for obj in self.iter_directory(remote_path) if not obj.is_dir]
+
+    def listing_entry(self, entry) -> RemoteEntry:
+        return RemoteEntry(entry.object_name, entry.size, entry.etag, entry.last_modified.timestamp())
+
+    def stat_entry(self, remote_path: str):
+        path = self._path(remote_path)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        if not path.is_file():
+            return None
+        return self.listing_entry(self._object(path, stat))
+
+    def _download(self, remote_path: str, local_file: str):
+        shutil.copyfile(self._path(remote_path), local_file)
+
+    def cached_file(self, remote_path: str, entry: RemoteEntry = None) -> str:
+        # the files are already local, caching them again would only copy
+        if (entry or self.stat_entry(remote_path)) is None:
+            raise RuntimeError('Please provide file path instead of directory')
+        return str(self._path(remote_path))
+
+    def get_object(self, remote_path, use_cache: bool = False):
+        return CachedObject(io.FileIO(self._path(remote_path), 'rb'))
+
+    def read_object(self, remote_path, use_cache: bool = False) -> bytes:
+        return self._path(remote_path).read_bytes()
+
+    def get_object_url(self, remote_path):
+        return self._path(remote_path).as_uri()
@@ -6,8 +6,10 @@
 @Date    :   2021/2/8
 @Desc    :   
 """
-from .data_repo import DataRepo
+from .data_repo import DataRepo, RemoteEntry
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import time
 from pathlib import Path
 from minio import Minio, S3Error
 
@@ -20,12 +22,19 @@ def parse_minio_config(cp):
             "bucket": cp.get("minio", "bucket")}
 
 
+def parse_minio_transfer_config(cp):
+    return {"workers": cp.getint("minio", "workers", fallback=8),
+            "part_size": cp.getint("minio", "partSize", fallback=64 * 1024 * 1024),
+            "retries": cp.getint("minio", "retries", fallback=3)}
+
+
 class MinIODataRepo(DataRepo):
     def __init__(self, cp):
         super().__init__(cp)
         self.logger = logging.getLogger(__name__)
         self.config = parse_minio_config(cp)
         self.default_bucket = self.config.pop("bucket")
+        self.transfer = parse_minio_transfer_config(cp)
         self.minio_client = Minio(**self.config)
         if not self.minio_client.bucket_exists(self.default_bucket):
             self.minio_client.make_bucket(self.default_bucket)
@@ -36,9 +45,12 @@ class MinIODataRepo(DataRepo):
         if not Path(local_file).is_file():
             self.logger.error(f'Error, provided path {local_file} is not a file, please use store_directory instead')
             raise RuntimeError('Please provide file path instead of directory')
-        self.minio_client.fput_object(self.default_bucket, self._format_path(remote_path),
-                                      self._format_path(local_file), metadata=metadata)
+        result = self._with_retry(self.minio_client.fput_object, self.default_bucket, self._format_path(remote_path),
+                                  self._format_path(local_file), metadata=metadata,
+                                  part_size=self.transfer["part_size"])
+        self._invalidate_listing(self._format_path(remote_path))
         self.logger.info(f'Finished storing file to Minio: {remote_path} from local: {local_file}')
+        return result.etag
 
     def store_directory(self, remote_path: str, local_dir: str, metadata=None):
         self.logger.info(f'Storing directory to Minio: {remote_path} from local: {local_dir}')
@@ -46,21 +58,26 @@ class MinIODataRepo(DataRepo):
         if not p.is_dir():
             self.logger.error(f'Error, provided path {local_dir} is not a directory.')
             raise RuntimeError('Please provide directory that exists locally')
-        for file in p.rglob("*"):
-            if file.is_file():
-                remote_file_path = str(Path(remote_path, str(file).replace(local_dir, "").lstrip("/")))
-                # TODO: metadata list?
-                self.store_file(str(file), remote_file_path, metadata=metadata)
+        files = [file for file in p.rglob("*") if file.is_file()]
+        with ThreadPoolExecutor(max_workers=self.transfer["workers"]) as pool:
+            # TODO: metadata list?
+            futures = [pool.submit(self.store_file, str(Path(remote_path, file.relative_to(p))), str(file),
+                                   metadata=metadata) for file in files]
+            for future in futures:
+                future.result()
         self.logger.info(f'Finished storing directory to Minio: {remote_path} from local: {local_dir}')
 
-    def retrieve_file(self, remote_path: str, local_file: str):
+    def retrieve_file(self, remote_path: str, local_file: str, check: bool = True, entry: RemoteEntry = None):
         self.logger.info(f'Retrieving file from Minio: {remote_path} to local: {local_file}')
-        if not self._check_file(remote_path):
+        if self.object_cache is not None:
+            self._retrieve_cached(remote_path, local_file, entry)
+            return
+        if check and not self._check_file(remote_path):
             self.logger.error(
                 f'Error, provided path {remote_path} is not a file, please use retrieve_directory instead')
             raise RuntimeError('Please provide file path instead of directory')
-        self.minio_client.fget_object(self.default_bucket, self._format_path(remote_path),
-                                      self._format_path(local_file))
+        self._with_retry(self.minio_client.fget_object, self.default_bucket, self._format_path(remote_path),
+                         self._format_path(local_file))
 
     def retrieve_directory(self, remote_path: str, local_dir: str):
         self.logger.info(f'Retrieving directory from Minio: {remote_path} to local: {local_dir}')
@@ -68,18 +85,56 @@ class MinIODataRepo(DataRepo):
             self.logger.error(
                 f'Error, provided path {remote_path} is not a directory, please use retrieve_file instead')
             raise RuntimeError('Please provide directory instead of file path')
-        for obj in self.list_directory(remote_path):
-            local_obj_dir = Path(local_dir, obj.object_name.replace(remote_path, ""))
-            if obj.is_dir:
-                if not local_obj_dir.exists():
-                    local_obj_dir.mkdir()
-            else:
-                self.retrieve_file(obj.object_name, str(local_obj_dir))
+        prefix = self._format_prefix(remote_path)
+        objects = self.minio_client.list_objects(self.default_bucket, prefix=prefix, recursive=True)
+        with ThreadPoolExecutor(max_workers=self.transfer["workers"]) as pool:
+            futures = []
+            for obj in objects:
+                local_obj_path = Path(local_dir, obj.object_name[len(prefix):].lstrip("/"))
+                local_obj_path.parent.mkdir(parents=True, exist_ok=True)
+                # the listing already proves the object exists, skip the per-file stat
+                futures.append(pool.submit(self.retrieve_file, obj.object_name, str(local_obj_path), check=False,
+                                           entry=self.listing_entry(obj)))
+            for future in futures:
+                future.result()
+        self.logger.info(f'Finished retrieving directory from Minio: {remote_path} to local: {local_dir}')
 
     def list_directory(self, remote_path: str):
-        formatted_path = self._format_path(remote_path)
-        object_list = self.minio_client.list_objects(self.default_bucket, prefix=formatted_path)
-        return [obj for obj in object_list]
+        formatted_path = self._format_prefix(remote_path)
+        key = ('list', formatted_path)
+        objects = self._cached_listing(key)
+        if objects is None:
+            objects = list(self.iter_directory(remote_path))
+            self._cache_listing(key, formatted_path, objects)
+        return objects
+
+    def iter_directory(self, remote_path: str, recursive: bool = False, start_after: str = None):
+        # list_objects pages through the bucket lazily, nothing is materialized here
+        return self.minio_client.list_objects(self.default_bucket, prefix=self._format_prefix(remote_path),
+                                              recursive=recursive, start_after=start_after)
+
+    def entry_name(self, entry) -> str:
+        return entry.object_name
+
+    def list_page(self, remote_path: str, page_size: int = 100, start_after: str = None):
+        return super().list_page(self._format_prefix(remote_path), page_size, start_after)
+
+    def list_entries(self, remote_path: str):
+        return [self.listing_entry(obj) for obj in self.iter_directory(remote_path) if not obj.is_dir]
+
+    def stat_entry(self, remote_path: str):
+        try:
+            stat = self.minio_client.stat_object(self.default_bucket, self._format_path(remote_path))
+        except S3Error:
+            return None
+        return self.listing_entry(stat)
+
+    def listing_entry(self, obj) -> RemoteEntry:
+        return RemoteEntry(obj.object_name, obj.size, obj.etag, obj.last_modified.timestamp())
+
+    def _download(self, remote_path: str, local_file: str):
+        self._with_retry(self.minio_client.fget_object, self.default_bucket, self._format_path(remote_path),
+                         local_file)
 
     def delete_file(self, remote_path: str):
         self.logger.info(f'Deleting object from Minio: {remote_path}.')
@@ -89,17 +144,45 @@ class MinIODataRepo(DataRepo):
         else:
             try:
                 self.minio_client.remove_object(self.default_bucket, self._format_path(remote_path))
+                self._invalidate_listing(self._format_path(remote_path))
                 self.logger.info(f'Object {remote_path} deleted from Minio.')
             except S3Error as e:
                 self.logger.error(f'Error deleting Object {remote_path} from Minio. {e}')
                 pass
 
-    def get_object(self, remote_path):
+    def get_object(self, remote_path, use_cache: bool = False):
+        """Stream the object straight from MinIO; nothing is written to disk unless use_cache is set.
+
+        With use_cache the whole object is first downloaded into the object cache and a seekable local
+        file is returned, which supports the same read/close/release_conn calls as the streamed response.
+        """
+        if use_cache and self.object_cache is not None:
+            return self._open_cached(remote_path)
         return self.minio_client.get_object(self.default_bucket, self._format_path(remote_path))
 
+    def read_object(self, remote_path, use_cache: bool = False) -> bytes:
+        """Read a whole object into memory, e.g. to hand encoded image bytes straight to the analyzer."""
+        response = self.get_object(remote_path, use_cache=use_cache)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
     def get_object_url(self, remote_path):
         return self.minio_client.presigned_get_object(self.default_bucket, self._format_path(remote_path))
 
+    def _with_retry(self, func, *args, **kwargs):
+        retries = self.transfer["retries"]
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except (S3Error, OSError) as e:
+                if attempt == retries or (isinstance(e, S3Error) and e.code in ("NoSuchKey", "AccessDenied")):
+                    raise
+                self.logger.warning(f'Minio transfer failed ({e}), retry {attempt + 1}/{retries}')
+                time.sleep(2 ** attempt)
+
     def _check_file(self, remote_path: str):
         try:
             if self.minio_client.stat_object(self.default_bucket, self._format_path(remote_path)):
@@ -108,6 +191,13 @@ class MinIODataRepo(DataRepo):
             return False
         return False
 
+    def _format_prefix(self, path: str):
+        # remote directory prefix: no local filesystem lookup, just make sure it ends with /
+        if not path:
+            return path
+        path = path.replace('\\', '/')
+        return path if path.endswith('/') else path + '/'
+
     def _format_path(self, path: str):
         # 如果是空字符串，直接返回
         if not path:
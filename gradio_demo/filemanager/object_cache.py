@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   object_cache.py
+@Author  :   yb_li
+@Date    :   2026/10/18
+@Desc    :   Content-addressed local disk cache for remote objects, shared between processes
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable
+import hashlib
+import io
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, concurrent misses may download twice
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class CachedObject(io.BufferedReader):
+    """A cached file opened for reading that can stand in for a MinIO get_object response."""
+
+    def release_conn(self):
+        pass
+
+
+class ObjectCache:
+    """Read-through cache keyed by remote path and version (ETag, or size and mtime).
+
+    Layout under cache_dir::
+
+        objects/ab/<key>   cached content, mtime is refreshed on every hit and drives LRU eviction
+        locks/ab.lock      flock stripes, a process downloading a key holds its stripe exclusively
+        tmp/               partial downloads, moved into objects/ with os.replace once complete
+        .evict.lock        held while one process trims the cache to max_bytes
+
+    A changed object gets a new key, so stale entries are never served and simply age out.
+
+    Each process keeps a running total of the cache size, taken from a scan of objects/ when the cache
+    is opened and increased by its own inserts. Only when that total exceeds max_bytes is objects/
+    scanned again, which also picks up what other processes added, and trimmed.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 10 * 1024 ** 3, prefetch_workers: int = 2):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.prefetch_workers = prefetch_workers
+        for name in ('objects', 'locks', 'tmp'):
+            os.makedirs(os.path.join(self.cache_dir, name), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._pool = None
+        self._pending = {}
+        self._pool_lock = threading.Lock()
+        self._total_lock = threading.Lock()
+        self._total = self._scan()[1]
+
+    @staticmethod
+    def key(remote_path: str, version: str) -> str:
+        return hashlib.sha256(f'{remote_path}\0{version}'.encode('utf-8')).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, 'objects', key[:2], key)
+
+    @contextmanager
+    def _flock(self, path: str):
+        if fcntl is None:
+            yield
+            return
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, remote_path: str, version: str, fetch: Callable[[str], None]) -> str:
+        """Return the local path of the cached object, calling fetch(tmp_path) to download it on a miss."""
+        key = self.key(remote_path, version)
+        path = self.path(key)
+        if self._touch(path):
+            self.hits += 1
+            return path
+        with self._flock(os.path.join(self.cache_dir, 'locks', f'{key[:2]}.lock')):
+            # another process may have finished the download while we waited for the lock
+            if self._touch(path):
+                self.hits += 1
+                return path
+            self.misses += 1
+            tmp_path = os.path.join(self.cache_dir, 'tmp', f'{key}.{os.getpid()}.{threading.get_ident()}')
+            try:
+                fetch(tmp_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        logger.debug('Cached %s (%s) as %s', remote_path, version, key)
+        with self._total_lock:
+            self._total += os.path.getsize(path)
+            over = self._total > self.max_bytes
+        if over:
+            self.evict(keep=path)
+        return path
+
+    def open(self, remote_path: str, version: str, fetch: Callable[[str], None]) -> CachedObject:
+        return self._retry(remote_path, version, fetch, lambda path: CachedObject(io.FileIO(path, 'rb')))
+
+    def copy(self, remote_path: str, version: str, fetch: Callable[[str], None], local_file: str):
+        """Copy the cached object to local_file, a private file the caller may modify."""
+        self._retry(remote_path, version, fetch, lambda path: shutil.copyfile(path, local_file))
+
+    def _retry(self, remote_path: str, version: str, fetch: Callable[[str], None], use: Callable[[str], object]):
+        # an entry can be evicted by another process between get and opening it, fetch it again once;
+        # once opened, removing the entry no longer affects the reader
+        for attempt in range(2):
+            path = self.get(remote_path, version, fetch)
+            try:
+                return use(path)
+            except FileNotFoundError:
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _scan(self):
+        entries, total = [], 0
+        for root, _, names in os.walk(os.path.join(self.cache_dir, 'objects')):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self, keep: str = None):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with self._flock(os.path.join(self.cache_dir, '.evict.lock')):
+            entries, total = self._scan()
+            if total > self.max_bytes:
+                for _, size, path in sorted(entries):
+                    if path == keep:
+                        continue
+                    try:
+                        # readers that already opened the file keep their handle
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+                logger.info('Evicted cache entries, %d bytes left in %s', total, self.cache_dir)
+            with self._total_lock:
+                self._total = total
+
+    def submit(self, key, func: Callable, *args):
+        """Run func(*args) in the background unless the same key is already pending."""
+        with self._pool_lock:
+            future = self._pending.get(key)
+            if future is not None and not future.done():
+                return future
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix='prefetch')
+            future = self._pending[key] = self._pool.submit(self._run_prefetch, func, *args)
+        # outside the lock: the callback runs right here if the future is already done
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key, future):
+        with self._pool_lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    @staticmethod
+    def _run_prefetch(func: Callable, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.warning('Prefetch of %s failed: %s', args[0] if args else func, e)
+            raise
+
+
+def parse_cache_config(cp) -> dict:
+    # an empty cache_dir disables the cache
+    enabled = cp.getboolean('cache', 'enabled', fallback=False)
+    return {"cache_dir": cp.get('cache', 'dir', fallback='') if enabled else '',
+            "max_bytes": cp.getint('cache', 'maxBytes', fallback=10 * 1024 ** 3),
+            "prefetch_workers": cp.getint('cache', 'prefetchWorkers', fallback=2)}
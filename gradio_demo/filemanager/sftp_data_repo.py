@@ -6,13 +6,15 @@
 @Date    :   2021/2/8
 @Desc    :   
 """
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from stat import S_ISDIR, S_ISREG
 
 import logging
-import pysftp
+import os
 
-from .data_repo import DataRepo
+from .data_repo import DataRepo, RemoteEntry
+from .sftp_pool import SFTPConnectionPool
 
 
 def parse_sftp_config(cp) -> dict:
@@ -24,14 +26,26 @@ def parse_sftp_config(cp) -> dict:
             }
 
 
+def parse_sftp_pool_config(cp) -> dict:
+    return {"max_size": cp.getint('sftp', 'poolSize', fallback=4),
+            "idle_timeout": cp.getfloat('sftp', 'poolIdleTimeout', fallback=300),
+            "health_check_interval": cp.getfloat('sftp', 'poolHealthCheckInterval', fallback=30)}
+
+
+def parse_sftp_transfer_config(cp) -> dict:
+    return {"tree_transfer": cp.getboolean('sftp', 'treeTransfer', fallback=True),
+            "workers": cp.getint('sftp', 'transferWorkers', fallback=cp.getint('sftp', 'poolSize', fallback=4))}
+
+
 class SFTPDataRepo(DataRepo):
     def __init__(self, cp):
         super().__init__(cp)
         self.logger = logging.getLogger(__name__)
         self.config = parse_sftp_config(cp)
         self.base_path = self.config.pop('basePath')
-        self.sftp = pysftp.Connection(**self.config)
-        self.logger.info("Connection to sftp server")
+        self.pool = SFTPConnectionPool(self.config, **parse_sftp_pool_config(cp))
+        self.transfer = parse_sftp_transfer_config(cp)
+        self.logger.info("Connection pool to sftp server")
 
     def store_file(self, local_file, remote_path, metadata=None):
         self.logger.info(f'Storing file to SFTP: {remote_path} from local: {local_file}')
@@ -44,7 +58,9 @@ class SFTPDataRepo(DataRepo):
             self.logger.info(f'Checking if remote parent directory exists')
             if not self._check_directory(remote_dir_name):
                 self.create_directory(remote_dir_name)
-        self.sftp.put(local_file, str(Path(self.base_path) / remote_path), preserve_mtime=True)
+        with self.pool.connection() as sftp:
+            sftp.put(local_file, str(Path(self.base_path) / remote_path), preserve_mtime=True)
+        self._invalidate_listing(remote_path)
         self.logger.info(f'Finished storing file to SFTP: {remote_path} from local: {local_file}')
 
     def store_directory(self, local_dir, remote_path, metadata=None):
@@ -52,31 +68,38 @@ class SFTPDataRepo(DataRepo):
         if not Path(local_dir).is_dir():
             self.logger.error(f'Error, provided path {local_dir} is not a directory.')
             raise RuntimeError('Please provide directory that exists locally')
-        for entry in Path(local_dir).iterdir():
-            tmp_remote_path = Path(remote_path) / entry.name
-            tmp_local_path = Path(local_dir) / entry.name
-            if not tmp_local_path.is_file():
-                try:
-                    self.create_directory(str(tmp_remote_path))
-                except OSError:
-                    pass
-                self.store_directory(str(tmp_local_path), str(tmp_remote_path))
-            else:
-                self.store_file(str(tmp_local_path), str(tmp_remote_path))
+        if self.transfer["tree_transfer"]:
+            self.store_tree(local_dir, remote_path)
+            return
+        with self.pool.connection():
+            for entry in Path(local_dir).iterdir():
+                tmp_remote_path = Path(remote_path) / entry.name
+                tmp_local_path = Path(local_dir) / entry.name
+                if not tmp_local_path.is_file():
+                    try:
+                        self.create_directory(str(tmp_remote_path))
+                    except OSError:
+                        pass
+                    self.store_directory(str(tmp_local_path), str(tmp_remote_path))
+                else:
+                    self.store_file(str(tmp_local_path), str(tmp_remote_path))
 
         self.logger.info(f'Finished storing directory to SFTP: {remote_path} from local: {local_dir}')
 
     def retrieve_file(self, remote_path, local_file, with_base_path=False):
         self.logger.info(f'Retrieving file from SFTP: {remote_path} to local: {local_file}')
+        if self.object_cache is not None and not with_base_path:
+            self._retrieve_cached(remote_path, local_file)
+            return
         if not self._check_file(remote_path, with_base_path):
             self.logger.error(
                 f'Error, provided path {remote_path} is not a file, please use retrieve_directory instead')
             raise RuntimeError('Please provide file path instead of directory')
 
-        if with_base_path:
-            self.sftp.get(remote_path, local_file, preserve_mtime=True)
-        else:
-            self.sftp.get(str(Path(self.base_path) / remote_path), local_file, preserve_mtime=True)
+        if not with_base_path:
+            remote_path = str(Path(self.base_path) / remote_path)
+        with self.pool.connection() as sftp:
+            sftp.get(remote_path, local_file, preserve_mtime=True)
 
     def retrieve_directory(self, remote_path, local_dir):
         self.logger.info(f'Retrieving directory from SFTP: {remote_path} to local: {local_dir}')
@@ -89,10 +112,16 @@ class SFTPDataRepo(DataRepo):
             raise RuntimeError('Please provide directory instead of file path')
         if not Path(local_dir).exists():
             Path(local_dir).mkdir()
-        self._retrieve_directory(str(Path(self.base_path) / remote_path), local_dir)
+        if self.transfer["tree_transfer"]:
+            self.retrieve_tree(remote_path, local_dir)
+            return
+        with self.pool.connection():
+            self._retrieve_directory(str(Path(self.base_path) / remote_path), local_dir)
 
     def _retrieve_directory(self, remote_path, local_dir):
-        for entry in self.sftp.listdir_attr(remote_path):
+        with self.pool.connection() as sftp:
+            entries = sftp.listdir_attr(remote_path)
+        for entry in entries:
             tmp_remote_path = remote_path + "/" + entry.filename
             tmp_local_path = Path(local_dir) / entry.filename
             mode = entry.st_mode
@@ -105,17 +134,128 @@ class SFTPDataRepo(DataRepo):
             elif S_ISREG(mode):
                 self.retrieve_file(tmp_remote_path, tmp_local_path, with_base_path=True)
 
+    def retrieve_tree(self, remote_path, local_dir, workers=None):
+        """Walk the remote tree once and download files over several pooled connections.
+
+        The attributes from listdir_attr are reused: no per-file isfile check is made and
+        files whose local copy already has the same size and mtime are skipped.
+        """
+        root = str(Path(self.base_path) / remote_path)
+        dirs, files = [], []
+        with self.pool.connection() as sftp:
+            pending = [(root, Path(local_dir))]
+            while pending:
+                remote_dir, local_sub_dir = pending.pop()
+                for entry in sftp.listdir_attr(remote_dir):
+                    tmp_remote_path = remote_dir + "/" + entry.filename
+                    tmp_local_path = local_sub_dir / entry.filename
+                    if S_ISDIR(entry.st_mode):
+                        dirs.append(tmp_local_path)
+                        pending.append((tmp_remote_path, tmp_local_path))
+                    elif S_ISREG(entry.st_mode):
+                        files.append((tmp_remote_path, tmp_local_path, entry.st_size, entry.st_mtime))
+        for local_sub_dir in dirs:
+            local_sub_dir.mkdir(parents=True, exist_ok=True)
+        files = [item for item in files if not self._is_same_local(*item[1:])]
+        self.logger.info(f'Retrieving {len(files)} files from SFTP tree {remote_path}')
+        self._parallel(lambda sftp, item: sftp.get(item[0], str(item[1]), preserve_mtime=True), files, workers)
+        self.logger.info(f'Finished retrieving SFTP tree {remote_path} to local: {local_dir}')
+
+    def store_tree(self, local_dir, remote_path, workers=None):
+        """Create all remote directories in one pass, then upload files over several pooled connections."""
+        root = Path(self.base_path) / remote_path
+        dirs, files = [], []
+        for cur_dir, sub_dirs, file_names in os.walk(local_dir):
+            rel_dir = Path(cur_dir).relative_to(local_dir)
+            dirs.extend(root / rel_dir / name for name in sub_dirs)
+            files.extend((str(Path(cur_dir) / name), str(root / rel_dir / name)) for name in file_names)
+        with self.pool.connection() as sftp:
+            # the root and any missing parents; inside the tree parents come before children
+            sftp.makedirs(str(root), mode=777)
+            for remote_dir in sorted(dirs, key=lambda d: len(d.parts)):
+                try:
+                    sftp.mkdir(str(remote_dir), mode=777)
+                except IOError:
+                    if not sftp.isdir(str(remote_dir)):
+                        raise
+        self.logger.info(f'Storing {len(files)} files to SFTP tree {remote_path}')
+        self._parallel(lambda sftp, item: sftp.put(item[0], item[1], preserve_mtime=True), files, workers)
+        self._invalidate_listing(remote_path)
+        self.logger.info(f'Finished storing SFTP tree {remote_path} from local: {local_dir}')
+
+    def _parallel(self, transfer, items, workers=None):
+        def run(item):
+            with self.pool.connection() as sftp:
+                transfer(sftp, item)
+
+        with ThreadPoolExecutor(max_workers=workers or self.transfer["workers"]) as executor:
+            for future in [executor.submit(run, item) for item in items]:
+                future.result()
+
+    @staticmethod
+    def _is_same_local(local_file, size, mtime):
+        try:
+            stat = os.stat(local_file)
+        except OSError:
+            return False
+        return stat.st_size == size and int(stat.st_mtime) == int(mtime)
+
     def list_directory(self, remote_path):
         if self._check_file(remote_path):
             self.logger.error(
                 f'Error, provided path {remote_path} is not a directory')
             raise RuntimeError('Please provide directory instead of file path')
-        return self.sftp.listdir(str(Path(self.base_path) / remote_path))
+        key = ('list', remote_path)
+        names = self._cached_listing(key)
+        if names is None:
+            with self.pool.connection() as sftp:
+                names = sftp.listdir(str(Path(self.base_path) / remote_path))
+            self._cache_listing(key, remote_path, names)
+        return names
+
+    def iter_directory(self, remote_path, recursive=False, start_after=None):
+        # SFTP returns a whole directory per round trip, pages are cut locally. Directories are keyed as
+        # 'name/' like MinIO prefixes: the key is used for sorting, compared with start_after and yielded
+        # by non-recursive listings, so it is also a valid page token. Recursive listings walk depth-first
+        # in global key order and skip whole subtrees that come before start_after.
+        yield from self._walk(remote_path, recursive, start_after)
+
+    def _walk(self, cur_path, recursive, start_after):
+        with self.pool.connection() as sftp:
+            attrs = sftp.listdir_attr(str(Path(self.base_path) / cur_path))
+        keys = sorted(str(Path(cur_path) / attr.filename) + ('/' if S_ISDIR(attr.st_mode) else '') for attr in attrs)
+        for key in keys:
+            if recursive and key.endswith('/'):
+                if start_after is None or key > start_after or start_after.startswith(key):
+                    yield from self._walk(key[:-1], recursive, start_after)
+            elif start_after is None or key > start_after:
+                yield key
+
+    def list_entries(self, remote_path):
+        with self.pool.connection() as sftp:
+            entries = sftp.listdir_attr(str(Path(self.base_path) / remote_path))
+        return [RemoteEntry(str(Path(remote_path) / entry.filename), entry.st_size, None, entry.st_mtime)
+                for entry in entries if S_ISREG(entry.st_mode)]
+
+    def stat_entry(self, remote_path):
+        try:
+            with self.pool.connection() as sftp:
+                stat = sftp.stat(str(Path(self.base_path) / remote_path))
+        except IOError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        return RemoteEntry(remote_path, stat.st_size, None, stat.st_mtime)
+
+    def _download(self, remote_path, local_file):
+        with self.pool.connection() as sftp:
+            sftp.get(str(Path(self.base_path) / remote_path), local_file)
 
     def create_directory(self, remote_path):
         if not Path(remote_path).parts[0] == self.base_path:
             remote_path = str(Path(self.base_path) / remote_path)
-        self.sftp.makedirs(remote_path, 777)
+        with self.pool.connection() as sftp:
+            sftp.makedirs(remote_path, 777)
 
     def delete_file(self, remote_path: str):
         self.logger.info(f'Deleting object from SFTP: {remote_path}.')
@@ -123,15 +263,18 @@ class SFTPDataRepo(DataRepo):
             self.logger.error(f'Given object does not exists')
             pass
         else:
-            self.sftp.remove(remote_path)
+            with self.pool.connection() as sftp:
+                sftp.remove(remote_path)
+            self._invalidate_listing(remote_path)
             self.logger.info(f'Object {remote_path} deleted from SFTP.')
 
     def _check_directory(self, remote_path, with_base_path=False):
         if not with_base_path:
             remote_path = str(Path(self.base_path) / remote_path)
         try:
-            if self.sftp.isdir(remote_path):
-                return True
+            with self.pool.connection() as sftp:
+                if sftp.isdir(remote_path):
+                    return True
         except IOError:
             return False
         return False
@@ -140,8 +283,9 @@ class SFTPDataRepo(DataRepo):
         if not with_base_path:
             remote_file = str(Path(self.base_path) / remote_file)
         try:
-            if self.sftp.isfile(remote_file):
-                return True
+            with self.pool.connection() as sftp:
+                if sftp.isfile(remote_file):
+                    return True
         except IOError:
             return False
         return False
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   sftp_pool.py
+@Author  :   yb_li
+@Date    :   2026/10/18
+@Desc    :   SFTP connection pool with health checks and idle eviction
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pysftp
+
+
+class SFTPConnectionPool:
+    def __init__(self, config: dict, max_size: int = 4, idle_timeout: float = 300, health_check_interval: float = 30):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = deque()  # (connection, last_used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._local = threading.local()
+        self._closed = False
+        self._reaper = threading.Thread(target=self._reap, daemon=True)
+        self._reaper.start()
+
+    @contextmanager
+    def connection(self):
+        # A thread that already holds a connection reuses it, so nested calls
+        # (e.g. store_directory -> store_file) cannot exhaust the pool.
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        self._slots.acquire()
+        broken = False
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        self._local.conn, self._local.depth = conn, 1
+        try:
+            yield conn
+        except (IOError, EOFError, OSError):
+            broken = not self._is_alive(conn)
+            raise
+        finally:
+            self._local.conn, self._local.depth = None, 0
+            self._checkin(conn, broken)
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.health_check_interval or self._is_alive(conn):
+                return conn
+            self.logger.info('Discarding broken sftp connection')
+            self._close(conn)
+        self.logger.info('Opening new sftp connection')
+        return pysftp.Connection(**self.config)
+
+    def _checkin(self, conn, broken: bool):
+        if broken or self._closed:
+            self._close(conn)
+            return
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def _reap(self):
+        while not self._closed:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            self.evict_idle()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [conn for conn, last_used in self._idle if now - last_used >= self.idle_timeout]
+            self._idle = deque((conn, last_used) for conn, last_used in self._idle
+                               if now - last_used < self.idle_timeout)
+        for conn in expired:
+            self.logger.info('Closing idle sftp connection')
+            self._close(conn)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+    @staticmethod
+    def _is_alive(conn) -> bool:
+        try:
+            conn.sftp_client.normalize('.')
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
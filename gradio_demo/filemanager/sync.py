@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   sync.py
+@Author  :   yb_li
+@Date    :   2026/10/18
+@Desc    :   Incremental directory sync based on a local manifest of size, mtime and md5
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+
+MANIFEST_NAME = '.sync_manifest.json'
+
+logger = logging.getLogger(__name__)
+
+
+def file_md5(path: str, chunk_size: int = 8 * 1024 * 1024) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class SyncManifest:
+    """Per-directory record of what was last uploaded.
+
+    Hashes are only recomputed when a file's size or mtime changes, and the ETag
+    returned by the last upload is kept so multipart ETags (which are not plain
+    md5 digests) can still be compared with the remote listing.
+    """
+
+    def __init__(self, local_dir: str):
+        self.path = os.path.join(local_dir, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def local_state(self, local_dir: str, name: str) -> dict:
+        stat = os.stat(os.path.join(local_dir, name))
+        entry = self.entries.get(name, {})
+        if entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            md5 = entry['md5']
+        else:
+            md5 = file_md5(os.path.join(local_dir, name))
+        return {'size': stat.st_size, 'mtime': stat.st_mtime, 'md5': md5}
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class SyncReport:
+    uploads: List[str] = field(default_factory=list)
+    deletes: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    dry_run: bool = False
+
+    def __str__(self):
+        prefix = '[dry-run] ' if self.dry_run else ''
+        return (f'{prefix}upload {len(self.uploads)}, delete {len(self.deletes)}, '
+                f'unchanged {len(self.unchanged)}, errors {len(self.errors)}')
+
+
+def _is_unchanged(local: dict, known: dict, remote) -> bool:
+    if remote is None or remote.size != local['size']:
+        return False
+    if remote.etag is None:
+        # backend without ETag (sftp): uploads preserve mtime
+        return int(remote.mtime) == int(local['mtime'])
+    etag = remote.etag.strip('"')
+    if etag == local['md5']:
+        return True
+    if known.get('etag'):
+        return known['etag'] == etag and known.get('md5') == local['md5']
+    if '-' in etag:
+        # multipart ETag and no upload of ours recorded for it (first sync or lost manifest):
+        # same size and uploaded after the local file last changed
+        return remote.mtime is not None and remote.mtime >= local['mtime']
+    return False
+
+
+def _is_synced(name: str, pattern: str) -> bool:
+    # the manifest lives in the synced directory but is never uploaded, even when the pattern matches it
+    return fnmatch.fnmatch(name, pattern) and name not in (MANIFEST_NAME, MANIFEST_NAME + '.tmp')
+
+
+def push_directory(data_repo, src_path: str, det_path: str, pattern: str = '*.mp4', delete: bool = True,
+                   dry_run: bool = False, workers: int = 4) -> SyncReport:
+    manifest = SyncManifest(src_path)
+    report = SyncReport(dry_run=dry_run)
+    remote = {os.path.basename(entry.name): entry for entry in data_repo.list_entries(det_path)
+              if _is_synced(os.path.basename(entry.name), pattern)}
+    local_names = sorted(name for name in os.listdir(src_path) if _is_synced(name, pattern))
+
+    states = {}
+    for name in local_names:
+        states[name] = manifest.local_state(src_path, name)
+        if _is_unchanged(states[name], manifest.entries.get(name, {}), remote.get(name)):
+            report.unchanged.append(name)
+            manifest.entries[name] = {**manifest.entries.get(name, {}), **states[name]}
+        else:
+            report.uploads.append(name)
+    if delete:
+        report.deletes = sorted(set(remote).difference(local_names))
+
+    if dry_run:
+        logger.info(str(report))
+        return report
+
+    def upload(name):
+        etag = data_repo.store_file(remote_path=os.path.join(det_path, name),
+                                    local_file=os.path.join(src_path, name))
+        return name, etag
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(upload, name) for name in report.uploads}
+        for name, future in futures.items():
+            try:
+                name, etag = future.result()
+            except Exception as e:
+                logger.error(f'Failed to upload {name}: {e}')
+                report.errors.append(name)
+                continue
+            manifest.entries[name] = {**states[name], 'etag': etag.strip('"') if etag else None}
+            logger.info(f'{os.path.join(src_path, name)}--->>>{det_path}')
+
+    for name in report.deletes:
+        data_repo.delete_file(os.path.join(det_path, name))
+        manifest.entries.pop(name, None)
+    for name in set(manifest.entries).difference(local_names):
+        manifest.entries.pop(name)
+    manifest.save()
+    logger.info(str(report))
+    return report
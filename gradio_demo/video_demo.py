@@ -8,17 +8,28 @@
 @Desc   : 从对象存储读取文件路径，从文件路径读取视频
 """
 
+import json
+import sys
+from collections import deque
+from pathlib import Path
+
 import gradio as gr
 from loguru import logger
 from filemanager import FileManager
 
+# 分析器和配置位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+PAGE_SIZE = 100
+
 
-def read_file_list(directory=None):
+def read_file_list(directory=None, start_after=None):
     file_manager = FileManager()
     logger.debug(f"read file list")
-    files = file_manager.list_directory(directory)
-    object_names = [file.object_name for file in files]
-    return object_names
+    # 只取一页，大目录也能立即显示；下一页从返回的位置继续
+    files, next_token = file_manager.list_page(directory, page_size=PAGE_SIZE, start_after=start_after or None)
+    object_names = [file_manager.data_repo.entry_name(file) for file in files]
+    return "\n".join(object_names), next_token or ""
 
 
 def read_video_url(filename):
@@ -28,13 +39,40 @@ def read_video_url(filename):
     return video_url
 
 
+def analyze_video(filename):
+    from main import cfg, get_analyzer
+    from tracker import FaceTracker
+    from video import analyze_stream
+
+    file_manager = FileManager()
+    logger.debug(f"analyze video from {filename}")
+    stream = file_manager.get_object(filename)
+    rows = deque(maxlen=cfg.video.max_rows)
+    n_frames = 0
+    tracker = FaceTracker(**cfg.tracker) if cfg.video.track else None
+    try:
+        for results in analyze_stream(get_analyzer(), stream, stride=cfg.video.stride, frame_batch=cfg.video.frame_batch,
+                                      queue_size=cfg.video.queue_size, batch_size=cfg.batch_size,
+                                      fix_img_size=cfg.fix_img_size, tracker=tracker):
+            n_frames += len(results)
+            rows.extend(json.dumps(result, ensure_ascii=False) for result in results)
+            yield f"已分析 {n_frames} 帧\n" + "\n".join(rows)
+    finally:
+        stream.close()
+        stream.release_conn()
+
+
 with gr.Blocks() as demo:
     gr.Markdown("# 对象存储文件列表")
     with gr.Row():
         path = gr.Textbox(label="输入对象存储文件夹路径")
         response = gr.Textbox(label="文件列表")
+    next_token = gr.Textbox(label="下一页起始位置")
     predict_button = gr.Button(value="获取文件列表")
-    predict_button.click(fn=read_file_list, inputs=path, outputs=response, api_name="read_video")
+    predict_button.click(fn=read_file_list, inputs=path, outputs=[response, next_token], api_name="read_video")
+    next_button = gr.Button(value="下一页")
+    next_button.click(fn=read_file_list, inputs=[path, next_token], outputs=[response, next_token],
+                      api_name="read_video_page")
 
     gr.Markdown("# 对象存储读取视频")
     with gr.Row():
@@ -43,4 +81,13 @@ with gr.Blocks() as demo:
     predict_button = gr.Button(value="读取视频")
     predict_button.click(fn=read_video_url, inputs=path, outputs=response, api_name="file_list")
 
+    gr.Markdown("# 对象存储视频人脸分析")
+    with gr.Row():
+        path = gr.Textbox(label="输入视频路径")
+        response = gr.Textbox(label="逐帧分析结果", lines=20, max_lines=20)
+    predict_button = gr.Button(value="分析视频")
+    predict_button.click(fn=analyze_video, inputs=path, outputs=response, api_name="analyze_video")
+
+# 逐帧结果通过生成器流式返回，需要开启队列
+demo.queue()
 demo.launch()
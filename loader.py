@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : loader.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 分析器延迟加载：预测器和后处理器首次使用时才实例化，TorchScript 模型冻结后缓存到本地，可选 ONNX Runtime 引擎，预热可配置
+"""
+
+import hashlib
+import os
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Sequence
+
+import torch
+from facetorch import FaceAnalyzer
+from facetorch.analyzer.detector import FaceDetector
+from facetorch.analyzer.predictor import FacePredictor
+from hydra.utils import instantiate
+from loguru import logger
+from omegaconf import DictConfig, OmegaConf
+
+from onnx_engine import OrtModule, onnx_path
+from pipeline import read_tensor
+
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def _cache_key(path_local: str, device: torch.device, precision: str = "fp32") -> str:
+    # 以模型文件路径、大小和修改时间作为键，不必每次启动都读取整个文件计算哈希
+    stat = os.stat(path_local)
+    key = f"{os.path.abspath(path_local)}:{stat.st_size}:{stat.st_mtime_ns}:{torch.__version__}:{device.type}"
+    if precision != "fp32":
+        key += f":{precision}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def _to_float(outputs):
+    if isinstance(outputs, torch.Tensor):
+        return outputs.float() if outputs.is_floating_point() else outputs
+    if isinstance(outputs, (list, tuple)):
+        return type(outputs)(_to_float(output) for output in outputs)
+    if isinstance(outputs, dict):
+        return {key: _to_float(value) for key, value in outputs.items()}
+    return outputs
+
+
+class CastModule(torch.nn.Module):
+    """输入转换为模型精度，浮点输出转换回 float32，后处理器无需改动"""
+
+    def __init__(self, module, dtype: torch.dtype):
+        super().__init__()
+        self.module = module
+        self.dtype = dtype
+
+    def forward(self, x):
+        return _to_float(self.module(x.to(self.dtype)))
+
+
+def convert_precision(module, precision: str, device: torch.device):
+    """int8 为 Linear 层动态量化（仅 CPU），bf16 为权重整体转换；返回的模块尚未冻结"""
+    if precision == "int8":
+        if device.type != "cpu":
+            logger.warning(f"int8 dynamic quantization is CPU only, keeping fp32 on {device}")
+            return module
+        return torch.quantization.quantize_dynamic_jit(module, {"": torch.quantization.default_dynamic_qconfig})
+    if precision == "bf16":
+        return module.to(torch.bfloat16)
+    return module
+
+
+def load_frozen_model(model, cache_dir: str = None, precision: str = "fp32"):
+    """加载 TorchScript 模型，按 precision 转换后冻结，结果保存在 cache_dir 中，下次直接加载"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision}, expected one of {PRECISIONS}")
+    path_local = model.downloader.path_local
+    if not os.path.exists(path_local):
+        # 与 BaseModel.load_model 相同，先建好模型目录再下载
+        os.makedirs(os.path.dirname(path_local), exist_ok=True)
+        logger.info(f"downloading model to {path_local}")
+        model.downloader.run()
+    wrap = (lambda m: CastModule(m, torch.bfloat16)) if precision == "bf16" else (lambda m: m)
+    if cache_dir is None and precision == "fp32":
+        return torch.jit.load(path_local, map_location=model.device).eval()
+
+    path_cached = None
+    if cache_dir is not None:
+        path_cached = os.path.join(cache_dir, _cache_key(path_local, model.device, precision) + ".pt")
+        if os.path.exists(path_cached):
+            logger.debug(f"load frozen {precision} model {path_cached} for {path_local}")
+            return wrap(torch.jit.load(path_cached, map_location=model.device))
+
+    module = torch.jit.load(path_local, map_location=model.device).eval()
+    module = convert_precision(module, precision, model.device)
+    try:
+        module = torch.jit.freeze(module.eval())
+    except Exception as e:
+        logger.warning(f"could not freeze {path_local}, using it as is: {e}")
+        return wrap(module)
+    if path_cached is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path_cached}.{os.getpid()}.tmp"
+        torch.jit.save(module, tmp_path)
+        os.replace(tmp_path, path_cached)
+        logger.info(f"cached frozen {precision} model {path_cached} for {path_local}")
+    return wrap(module)
+
+
+def load_model_for_engine(model, cache_dir: str = None, precision: str = "fp32", engine: str = "torchscript",
+                          engine_options: Dict = None, dynamic_dims: Sequence[int] = (0,)):
+    """engine 为 onnx 时返回 OrtModule，ONNX 文件已存在则不再加载 TorchScript 模型"""
+    if engine == "torchscript":
+        return load_frozen_model(model, cache_dir, precision)
+    if engine != "onnx":
+        raise ValueError(f"unknown engine {engine}, expected torchscript or onnx")
+    if model.device.type != "cpu":
+        logger.warning(f"onnx engine runs on the CPU execution provider only, using torchscript on {model.device}")
+        return load_frozen_model(model, cache_dir, precision)
+    if precision != "fp32":
+        logger.warning(f"{precision} is not supported by the onnx engine, exporting the fp32 model")
+    path_local = model.downloader.path_local
+    if not os.path.exists(path_local):
+        # 与 BaseModel.load_model 相同，先建好模型目录再下载
+        os.makedirs(os.path.dirname(path_local), exist_ok=True)
+        logger.info(f"downloading model to {path_local}")
+        model.downloader.run()
+    path = onnx_path(path_local, _cache_key(path_local, model.device))
+    return OrtModule(path, lambda: torch.jit.load(path_local, map_location=model.device).eval(),
+                     dynamic_dims=dynamic_dims, options=engine_options)
+
+
+class CachedFaceDetector(FaceDetector):
+    def __init__(self, *args, cache_dir: str = None, engine: str = "torchscript", engine_options: Dict = None,
+                 **kwargs):
+        self.cache_dir = cache_dir
+        self.engine = engine
+        self.engine_options = engine_options
+        super().__init__(*args, **kwargs)
+
+    def load_model(self):
+        # 检测器输入的高和宽随图像变化
+        return load_model_for_engine(self, self.cache_dir, engine=self.engine, engine_options=self.engine_options,
+                                     dynamic_dims=(0, 2, 3))
+
+
+class CachedFacePredictor(FacePredictor):
+    def __init__(self, *args, cache_dir: str = None, precision: str = "fp32", engine: str = "torchscript",
+                 engine_options: Dict = None, **kwargs):
+        self.cache_dir = cache_dir
+        self.precision = precision
+        self.engine = engine
+        self.engine_options = engine_options
+        super().__init__(*args, **kwargs)
+
+    def load_model(self):
+        return load_model_for_engine(self, self.cache_dir, self.precision, self.engine, self.engine_options)
+
+
+class LazyComponents(Mapping):
+    """按配置顺序列出名称，首次取值时才实例化；遍历名称不会触发加载"""
+
+    def __init__(self, cfgs: DictConfig, build):
+        self._cfgs = cfgs
+        self._build = build
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str):
+        if name not in self._loaded:
+            with self._lock:
+                if name not in self._loaded:
+                    logger.info(f"loading {name}")
+                    self._loaded[name] = self._build(name, self._cfgs[name])
+        return self._loaded[name]
+
+    def __iter__(self):
+        return iter(self._cfgs)
+
+    def __len__(self) -> int:
+        return len(self._cfgs)
+
+    def __contains__(self, name) -> bool:
+        return name in self._cfgs
+
+    @property
+    def loaded(self) -> List[str]:
+        return list(self._loaded)
+
+
+class LazyFaceAnalyzer(FaceAnalyzer):
+    """与 FaceAnalyzer 相同的属性，但检测器在首次使用时加载，predictors/utilizers 为延迟加载的映射
+
+    cache_dir 不为空时检测器和预测器使用冻结模型缓存；precision 为预测器名称到 fp32/int8/bf16 的映射；
+    engine 为 torchscript 或 onnx。
+    """
+
+    def __init__(self, cfg: DictConfig, cache_dir: str = None, precision: Dict[str, str] = None,
+                 engine: str = "torchscript", engine_options: Dict = None):
+        self.cfg = cfg
+        self.cache_dir = cache_dir
+        self.precision = dict(precision or {})
+        self.engine = engine
+        self.engine_options = dict(engine_options or {})
+        self.logger = instantiate(self.cfg.logger).logger
+        self.logger.info("Initializing LazyFaceAnalyzer")
+        self.reader = instantiate(self.cfg.reader)
+        self._detector = None
+        self._detector_lock = threading.Lock()
+        self.unifier = instantiate(self.cfg.unifier) if "unifier" in self.cfg else None
+        self.predictors = LazyComponents(self.cfg.get("predictor", {}), self._build_predictor)
+        self.utilizers = LazyComponents(self.cfg.get("utilizer", {}), lambda name, c: instantiate(c))
+
+    @property
+    def detector(self) -> FaceDetector:
+        if self._detector is None:
+            with self._detector_lock:
+                if self._detector is None:
+                    logger.info("loading detector")
+                    self._detector = instantiate(self._model_cfg(self.cfg.detector, CachedFaceDetector,
+                                                                 **self._engine_kwargs()))
+        return self._detector
+
+    def _engine_kwargs(self) -> Dict:
+        if self.engine == "torchscript":
+            return {}
+        return {"engine": self.engine, "engine_options": self.engine_options}
+
+    def _build_predictor(self, name: str, cfg: DictConfig) -> FacePredictor:
+        extra = self._engine_kwargs()
+        precision = self.precision.get(name, "fp32")
+        if precision != "fp32":
+            logger.info(f"predictor {name} uses {precision}")
+            extra["precision"] = precision
+        return instantiate(self._model_cfg(cfg, CachedFacePredictor, **extra))
+
+    def _model_cfg(self, cfg: DictConfig, cls, **extra) -> DictConfig:
+        if self.cache_dir is None and not extra:
+            return cfg
+        # 先解析插值（如 ${analyzer.device}），脱离根配置后才能替换 _target_
+        cfg = OmegaConf.create(OmegaConf.to_container(cfg, resolve=True))
+        return OmegaConf.merge(cfg, {"_target_": f"{cls.__module__}.{cls.__name__}", "cache_dir": self.cache_dir,
+                                     **extra})
+
+
+def warmup(analyzer: FaceAnalyzer, predictors: Iterable[str] = None, sizes: Sequence[Sequence[int]] = ((1080, 1080),),
+           batch_size: int = 1, face_size: int = 380):
+    """用随机输入预热检测器（每种输入尺寸一次）和指定的预测器
+
+    predictors 为 None 时只预热已经加载的预测器，不会为了预热把其余预测器全部加载。
+    """
+    for height, width in sizes:
+        image = torch.randint(0, 256, (3, height, width), dtype=torch.uint8)
+        data = read_tensor(analyzer, image, fix_img_size=False)
+        analyzer.detector.run(data)
+        logger.info(f"warmed up detector at {height}x{width}")
+    if predictors is None:
+        # 普通的 FaceAnalyzer 构造时已加载全部预测器
+        names = list(getattr(analyzer.predictors, "loaded", analyzer.predictors))
+    else:
+        names = list(predictors)
+    faces = torch.rand(batch_size, 3, face_size, face_size)
+    for name in names:
+        analyzer.predictors[name].run(faces)
+        logger.info(f"warmed up predictor {name}")
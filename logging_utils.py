@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : logging_utils.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 推理热路径的日志：后台线程写入、消息延迟格式化、按阶段采样和限流，facetorch 日志与 loguru 共用同一套规则
+"""
+
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from facetorch.logger import CustomJsonFormatter, LoggerJsonFile
+from loguru import logger
+
+
+def truncate(text: str, max_chars: int = 2000) -> str:
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... ({len(text) - max_chars} more chars)"
+
+
+class Sampler:
+    """按消息中第一个冒号之前的部分（facetorch 计时日志形如 "FacePredictor.run: 12.3 ms"）分组
+
+    sample_rates 为各组保留的比例；rate_limit 为每组每秒最多记录的条数，0 表示不限。
+    WARNING 及以上级别总是保留。
+    """
+
+    def __init__(self, sample_rates: Dict[str, float] = None, rate_limit: float = 0):
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limit = rate_limit
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def allow(self, levelno: int, message: str) -> bool:
+        if levelno >= logging.WARNING:
+            return True
+        key = message.split(":", 1)[0]
+        rate = self.sample_rates.get(key, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self.dropped += 1
+            return False
+        if self.rate_limit > 0:
+            now = time.monotonic()
+            with self._lock:
+                # 令牌桶：容量为一秒的配额
+                tokens, last = self._buckets.get(key, (self.rate_limit, now))
+                tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+                allowed = tokens >= 1
+                self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if not allowed:
+                self.dropped += 1
+                return False
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sampler: Sampler):
+        super().__init__()
+        self.sampler = sampler
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # 分组只看格式字符串，不在调用线程中格式化参数
+        return self.sampler.allow(record.levelno, str(record.msg))
+
+
+class LazyQueueHandler(QueueHandler):
+    """不在调用线程中格式化，原样放入有界队列；队列满时丢弃并计数，不阻塞推理"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AsyncLoggerJsonFile(LoggerJsonFile):
+    """与 LoggerJsonFile 相同的 JSON 输出，但由后台线程写控制台和文件，调用方只做入队
+
+    已有的处理器（包括 facetorch 导入时添加的控制台处理器）会被替换，同名 logger 的所有日志都经过采样和队列。
+    """
+
+    def __init__(self, name: str = "facetorch", level: int = logging.CRITICAL, path_file: Optional[str] = None,
+                 json_format: str = "%(asctime)s %(levelname)s %(message)s", queue_size: int = 10000,
+                 sample_rates: Dict[str, float] = None, rate_limit: float = 0, console: bool = True):
+        self.queue_size = queue_size
+        self.sampler = Sampler(sample_rates, rate_limit)
+        self.console = console
+        self.listener = None
+        super().__init__(name=name, level=level, path_file=path_file, json_format=json_format)
+
+    def configure(self):
+        self.logger.setLevel(self.level)
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            if isinstance(handler, QueueHandler):
+                handler.close()
+
+        formatter = CustomJsonFormatter(fmt=self.json_format)
+        handlers = []
+        if self.console:
+            handlers.append(logging.StreamHandler())
+        if self.path_file is not None:
+            os.makedirs(os.path.dirname(self.path_file), exist_ok=True)
+            handlers.append(logging.FileHandler(self.path_file, mode="w"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            handler.setLevel(self.level)
+
+        log_queue = queue.Queue(maxsize=self.queue_size)
+        self.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+        queue_handler = LazyQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(self.sampler))
+        self.logger.addHandler(queue_handler)
+        self.logger.propagate = False
+
+
+def configure_loguru(level: str = "INFO", enqueue: bool = True, path_file: str = None,
+                     sample_rates: Dict[str, float] = None, rate_limit: float = 0) -> Sampler:
+    """loguru 改为后台线程写入（enqueue），并使用相同的采样和限流规则；返回 sampler 以便查看丢弃数"""
+    sampler = Sampler(sample_rates, rate_limit)
+
+    def _filter(record) -> bool:
+        return sampler.allow(record["level"].no, record["message"])
+
+    logger.remove()
+    logger.add(sys.stderr, level=level, enqueue=enqueue, filter=_filter)
+    if path_file:
+        os.makedirs(os.path.dirname(path_file) or ".", exist_ok=True)
+        logger.add(path_file, level=level, enqueue=enqueue, filter=_filter, rotation="100 MB")
+    return sampler
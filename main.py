@@ -1,42 +1,101 @@
 from facetorch import FaceAnalyzer
+from facetorch.datastruct import Response
 from omegaconf import OmegaConf
-from torch.nn.functional import cosine_similarity
 from typing import Dict
-import operator
+import os
+import threading
+import torch
 import torchvision
 from loguru import logger
 
+from encoding import summarize_response
+from gallery import FaceGallery, response_embeddings
+from loader import LazyFaceAnalyzer, warmup
+from logging_utils import configure_loguru
+from predict_stage import PredictorStage
+
 # 加载配置
 path_img_input = "./test.jpg"
 path_img_output = "/test_output.jpg"
-path_config = "config.yml"
+path_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yml")
 
 cfg = OmegaConf.load(path_config)
+# 自适应检测输入尺寸为可选模式，开启时替换 reader，变换等其余参数沿用配置
+if cfg.adaptive_reader.enabled:
+    cfg.analyzer.reader._target_ = "adaptive.AdaptiveImageReader"
+    for key in ("sizes", "min_face_size", "detector_min_face"):
+        cfg.analyzer.reader[key] = cfg.adaptive_reader[key]
+configure_loguru(level=cfg.logging.level, enqueue=cfg.logging.enqueue, path_file=cfg.logging.path_file,
+                 sample_rates=cfg.logging.sample_rates, rate_limit=cfg.logging.rate_limit)
 
 # 启动模型
-# initialize
-analyzer = FaceAnalyzer(cfg.analyzer)
+# 首次调用 get_analyzer 时才构建分析器，各预测器在第一次使用时才加载
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer() -> FaceAnalyzer:
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                cache_dir = cfg.model_cache.dir if cfg.model_cache.enabled else None
+                precision = OmegaConf.to_container(cfg.precision) if "precision" in cfg else None
+                engine_options = OmegaConf.to_container(cfg.engine.onnx)
+                _analyzer = LazyFaceAnalyzer(cfg.analyzer, cache_dir=cache_dir, precision=precision,
+                                             engine=cfg.engine.name, engine_options=engine_options)
+    return _analyzer
+
+
+def make_predictor_stage(analyzer: FaceAnalyzer, batch_size: int = None):
+    """按配置创建共享预处理、并行推理的预测器执行阶段，未启用时返回 None"""
+    if not cfg.predict_stage.enabled:
+        return None
+    return PredictorStage(analyzer, batch_size=batch_size or cfg.batch_size, workers=cfg.predict_stage.workers,
+                          shared_preprocess=cfg.predict_stage.shared_preprocess)
+
+
+def warmup_analyzer(analyzer: FaceAnalyzer):
+    if cfg.warmup.enabled:
+        warmup(analyzer, predictors=cfg.warmup.predictors, sizes=cfg.warmup.sizes, batch_size=cfg.warmup.batch_size)
 
 
 # 嵌入向量余弦相似度
-def compute_embed_similarity(predictor_name: str = "verify", base_face_id: int = 0) -> Dict:
-    base_emb = response.faces[base_face_id].preds[predictor_name].logits
-    sim_dict = {face.indx: cosine_similarity(base_emb, face.preds[predictor_name].logits, dim=0).item() for face in
-                response.faces}
-    sim_dict_sorted = dict(sorted(sim_dict.items(), key=operator.itemgetter(1), reverse=True))
-    return sim_dict_sorted
+def compute_embed_similarity(response: Response, predictor_name: str = "verify", base_face_id: int = 0) -> Dict:
+    indices, embs = response_embeddings(response, predictor_name)
+    if not indices:
+        return {}
+    embs = torch.nn.functional.normalize(torch.from_numpy(embs), dim=1)
+    sims = embs @ embs[indices.index(base_face_id)]
+    order = torch.argsort(sims, descending=True).tolist()
+    return {indices[i]: sims[i].item() for i in order}
+
+
+# 人脸底库，按预测器名称缓存，避免每次检索重新加载
+galleries: Dict[str, FaceGallery] = {}
+
+
+def get_gallery(predictor_name: str = "verify", dim: int = None) -> FaceGallery:
+    if predictor_name not in galleries:
+        gallery_cfg = cfg.gallery[predictor_name]
+        galleries[predictor_name] = FaceGallery.open(gallery_cfg.path, dim=dim, dtype=gallery_cfg.dtype,
+                                                     chunk_rows=cfg.gallery.chunk_rows)
+    return galleries[predictor_name]
+
+
+# 与人脸底库比对
+def search_gallery(response: Response, predictor_name: str = "verify", k: int = None) -> Dict:
+    if predictor_name not in galleries and not FaceGallery.exists(cfg.gallery[predictor_name].path):
+        # 还没有登记过任何人脸，底库尚未创建
+        return {}
+    gallery = get_gallery(predictor_name)
+    return gallery.search_response(response, predictor_name=predictor_name, k=k or cfg.gallery.top_k)
 
 
 if __name__ == "__main__":
     # 预热模型
-    response = analyzer.run(
-        path_image=path_img_input,
-        batch_size=cfg.batch_size,
-        fix_img_size=cfg.fix_img_size,
-        return_img_data=False,
-        include_tensors=cfg.include_tensors,
-        path_output=path_img_output,
-    )
+    analyzer = get_analyzer()
+    warmup_analyzer(analyzer)
 
     # 按照配置文件的设置进行推理
     response = analyzer.run(
@@ -47,7 +106,8 @@ if __name__ == "__main__":
         include_tensors=cfg.include_tensors,
         path_output=path_img_output,
     )
-    logger.debug(f"inference response: {response}")
+    logger.opt(lazy=True).debug("inference response: {}",
+                                lambda: summarize_response(response, cfg.logging.summary_max_chars))
 
     # 输出图像
     pil_image = torchvision.transforms.functional.to_pil_image(response.img)
@@ -58,10 +118,10 @@ if __name__ == "__main__":
     logger.info(f"face expression recognition: {fer_dict}")
 
     # 人脸表征学习
-    compute_embed_similarity(predictor_name="embed")
+    compute_embed_similarity(response, predictor_name="embed")
 
     # 人脸识别
-    compute_embed_similarity(predictor_name="verify")
+    compute_embed_similarity(response, predictor_name="verify")
 
     # AU识别
     au_dict = {face.indx: face.preds["au"].label for face in response.faces}
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : metrics.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : Prometheus 监控指标（阶段耗时、人脸数、队列深度、缓存命中率、内存）以及按需采集 torch profiler 跟踪
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional
+from urllib.parse import parse_qs, urlparse
+
+import torch
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+STAGE_SECONDS = Histogram("facetorch_stage_seconds", "各阶段耗时", ["stage"],
+                          buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_SECONDS = Histogram("facetorch_request_seconds", "单次请求总耗时", ["source"],
+                            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+FACES_PER_IMAGE = Histogram("facetorch_faces_per_image", "每张图像检测到的人脸数",
+                            buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.labels(stage=name).observe(seconds)
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class AnalyzerCollector:
+    """抓取时才读取的指标：队列深度、结果缓存命中率、各进程常驻内存和 GPU 显存"""
+
+    def __init__(self, queue_depth: Callable[[], int] = None, cache=None,
+                 worker_pids: Callable[[], Iterable[int]] = None):
+        self.queue_depth = queue_depth
+        self.cache = cache
+        self.worker_pids = worker_pids
+
+    def collect(self):
+        if self.queue_depth is not None:
+            yield GaugeMetricFamily("facetorch_queue_depth", "等待或正在处理的请求数", value=self.queue_depth())
+        if self.cache is not None:
+            yield GaugeMetricFamily("facetorch_result_cache_hit_rate", "结果缓存命中率", value=self.cache.hit_rate)
+            yield GaugeMetricFamily("facetorch_result_cache_hits", "结果缓存命中次数", value=self.cache.hits)
+            yield GaugeMetricFamily("facetorch_result_cache_misses", "结果缓存未命中次数", value=self.cache.misses)
+        memory = GaugeMetricFamily("facetorch_rss_bytes", "进程常驻内存", labels=["process"])
+        pids = [("main", os.getpid())]
+        if self.worker_pids is not None:
+            pids += [(f"worker{i}", pid) for i, pid in enumerate(self.worker_pids())]
+        for name, pid in pids:
+            rss = _rss_bytes(pid)
+            if rss is not None:
+                memory.add_metric([name], rss)
+        yield memory
+        if torch.cuda.is_available():
+            yield GaugeMetricFamily("facetorch_cuda_allocated_bytes", "CUDA 已分配显存",
+                                    value=torch.cuda.memory_allocated())
+
+
+@contextmanager
+def torch_trace(path: str = None):
+    """path 不为空时用 torch profiler 记录代码块，并保存为 Chrome trace"""
+    if path is None:
+        yield
+        return
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+        yield
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    prof.export_chrome_trace(path)
+    logger.info(f"saved profiler trace {path}")
+
+
+class Profiler:
+    """通过 /profile?requests=N 开启，之后 N 个请求各保存一份跟踪"""
+
+    def __init__(self, trace_dir: str):
+        self.trace_dir = trace_dir
+        self._remaining = 0
+        self._lock = threading.Lock()
+
+    def arm(self, requests: int):
+        with self._lock:
+            self._remaining = requests
+        logger.info(f"profiling the next {requests} requests into {self.trace_dir}")
+
+    @property
+    def remaining(self) -> int:
+        return self._remaining
+
+    def next_trace_path(self) -> Optional[str]:
+        """需要采集时返回本次请求的跟踪文件路径，否则返回 None"""
+        if self._remaining <= 0:
+            return None
+        with self._lock:
+            if self._remaining <= 0:
+                return None
+            self._remaining -= 1
+        return os.path.join(self.trace_dir, f"trace_{time.strftime('%Y%m%d_%H%M%S')}_{time.monotonic_ns()}.json")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    profiler: Profiler = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            body, content_type = generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+        elif url.path == "/profile" and self.profiler is not None:
+            requests = int(parse_qs(url.query).get("requests", ["1"])[0])
+            self.profiler.arm(requests)
+            body, content_type = f"profiling next {requests} requests\n".encode("utf-8"), "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, profiler: Profiler = None, collector: AnalyzerCollector = None,
+                         host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """在后台线程提供 /metrics 和 /profile"""
+    if collector is not None:
+        REGISTRY.register(collector)
+    handler = type("MetricsHandler", (_Handler,), {"profiler": profiler})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"metrics server listening on {host}:{port}")
+    return server
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : onnx_engine.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : ONNX Runtime 推理引擎：TorchScript 模型首次执行时导出为 ONNX，保存在原模型文件旁边，之后用 CPU 执行器运行
+"""
+
+import os
+import threading
+from typing import Callable, Dict, Sequence
+
+import torch
+from loguru import logger
+
+
+def onnx_path(path_local: str, key: str) -> str:
+    """model.pt -> model.<key>.onnx，key 随模型文件和 torch 版本变化"""
+    return f"{os.path.splitext(path_local)[0]}.{key[:12]}.onnx"
+
+
+def export_onnx(module, example: torch.Tensor, path: str, dynamic_dims: Sequence[int] = (0,), opset: int = 17):
+    """导出到临时文件后原子替换，多个进程同时导出时不会读到写了一半的文件"""
+    dynamic_axes = {"input": {dim: f"dim{dim}" for dim in dynamic_dims}}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        outputs = module(example)
+    n_outputs = len(outputs) if isinstance(outputs, (list, tuple)) else 1
+    output_names = [f"output{i}" for i in range(n_outputs)]
+    torch.onnx.export(module, (example,), tmp_path, input_names=["input"], output_names=output_names,
+                      dynamic_axes=dynamic_axes, opset_version=opset)
+    os.replace(tmp_path, path)
+    logger.info(f"exported onnx model {path}")
+
+
+class OrtModule(torch.nn.Module):
+    """替换 FaceDetector/FacePredictor 的 model 属性，调用方式与 TorchScript 模块相同
+
+    ONNX 文件不存在时，第一次调用用实际输入形状导出（dynamic_dims 指定可变维度）。
+    """
+
+    def __init__(self, path: str, load_source: Callable[[], torch.nn.Module], dynamic_dims: Sequence[int] = (0,),
+                 options: Dict = None):
+        super().__init__()
+        self.path = path
+        self.load_source = load_source
+        self.dynamic_dims = tuple(dynamic_dims)
+        self.options = dict(options or {})
+        self._session = None
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._session = self._create_session()
+
+    def _create_session(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # 默认跟随 torch 的线程数，多进程服务中每个工作进程只用分到的核心
+        options.intra_op_num_threads = self.options.get("intra_op_threads") or torch.get_num_threads()
+        options.inter_op_num_threads = 1
+        logger.info(f"loading onnx model {self.path} with {options.intra_op_num_threads} threads")
+        return ort.InferenceSession(self.path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def _ensure_session(self, example: torch.Tensor):
+        with self._lock:
+            if self._session is None:
+                if not os.path.exists(self.path):
+                    export_onnx(self.load_source(), example, self.path, self.dynamic_dims,
+                                self.options.get("opset", 17))
+                self._session = self._create_session()
+        return self._session
+
+    def forward(self, x: torch.Tensor):
+        session = self._session or self._ensure_session(x)
+        outputs = session.run(None, {"input": x.detach().cpu().contiguous().numpy()})
+        outputs = [torch.from_numpy(output) for output in outputs]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
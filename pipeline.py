@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : pipeline.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 将 FaceAnalyzer.run 拆分为读取和分析两个阶段，便于在不同线程中流水线执行
+"""
+
+import time
+from contextlib import contextmanager
+from importlib.metadata import version
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import torch
+import torchvision
+from facetorch import FaceAnalyzer
+from facetorch.datastruct import Face, ImageData, Response
+
+
+# 可直接分析的输入：文件路径、编码后的字节、解码后的数组或张量
+ImageSource = Union[str, bytes, bytearray, memoryview, np.ndarray, torch.Tensor]
+
+# 后处理器依赖：align 需要 align 预测器的输出，draw_landmarks 需要 align 后处理器生成的关键点
+UTILIZER_REQUIRES = {
+    "align": ("predictor", "align"),
+    "draw_landmarks": ("utilizer", "align"),
+}
+
+
+# 阶段耗时回调 hook(stage_name, seconds)，供基准测试和监控统计使用
+_stage_hooks: List[Callable[[str, float], None]] = []
+
+
+def add_stage_hook(hook: Callable[[str, float], None]):
+    _stage_hooks.append(hook)
+
+
+def remove_stage_hook(hook: Callable[[str, float], None]):
+    if hook in _stage_hooks:
+        _stage_hooks.remove(hook)
+
+
+def report_stage(name: str, seconds: float):
+    for hook in list(_stage_hooks):
+        hook(name, seconds)
+
+
+@contextmanager
+def timed_stage(name: str):
+    """阶段名：read、detect、unify、predict.<预测器>、utilize.<后处理器>"""
+    if not _stage_hooks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        report_stage(name, time.perf_counter() - start)
+
+
+def select_stages(analyzer: FaceAnalyzer, predictors: Iterable[str] = None, utilizers: Iterable[str] = None,
+                  draw: bool = True) -> Tuple[List[str], List[str]]:
+    """确定本次请求需要执行的预测器和后处理器，按配置中的顺序返回
+
+    predictors/utilizers 为 None 表示全部；显式请求的后处理器会自动带上其依赖，
+    未显式请求时依赖不满足的后处理器被跳过；draw 为 False 时不执行绘制。
+    """
+    predictor_names = set(analyzer.predictors if predictors is None else predictors)
+    unknown = predictor_names.difference(analyzer.predictors)
+    if unknown:
+        raise ValueError(f"unknown predictors: {sorted(unknown)}")
+    explicit = utilizers is not None
+    utilizer_names = set(analyzer.utilizers if utilizers is None else utilizers)
+    unknown = utilizer_names.difference(analyzer.utilizers)
+    if unknown:
+        raise ValueError(f"unknown utilizers: {sorted(unknown)}")
+    if not draw:
+        utilizer_names = {name for name in utilizer_names if not name.startswith("draw")}
+
+    # 依赖只有一层链式关系，按配置顺序逆序处理即可传递
+    for name in reversed(list(analyzer.utilizers)):
+        if name not in utilizer_names or name not in UTILIZER_REQUIRES:
+            continue
+        kind, dependency = UTILIZER_REQUIRES[name]
+        available = predictor_names if kind == "predictor" else utilizer_names
+        if dependency in available:
+            continue
+        if explicit:
+            available.add(dependency)
+        else:
+            utilizer_names.discard(name)
+    return ([name for name in analyzer.predictors if name in predictor_names],
+            [name for name in analyzer.utilizers if name in utilizer_names])
+
+
+def read_image(analyzer: FaceAnalyzer, path_image: str, fix_img_size: bool = False) -> ImageData:
+    """读取并预处理图像，只用到 reader，可以在工作线程中提前执行"""
+    with timed_stage("read"):
+        data = analyzer.reader.run(path_image, fix_img_size=fix_img_size)
+    data.version = version("facetorch")
+    return data
+
+
+def read_tensor(analyzer: FaceAnalyzer, tensor: torch.Tensor, fix_img_size: bool = False) -> ImageData:
+    """从已解码的 uint8 RGB 张量 (C, H, W) 构造 ImageData，处理方式与 reader 读取文件后一致"""
+    with timed_stage("read"):
+        data = ImageData(path_input=None)
+        data.tensor = tensor.unsqueeze(0) if tensor.dim() == 3 else tensor
+        data.tensor = data.tensor.to(analyzer.reader.device)
+        if fix_img_size:
+            data.tensor = analyzer.reader.transform(data.tensor)
+        data.img = data.tensor.squeeze(0).cpu()
+        data.tensor = data.tensor.type(torch.float32)
+        data.set_dims()
+    data.version = version("facetorch")
+    return data
+
+
+def decode_image(source: ImageSource) -> torch.Tensor:
+    """解码为 (3, H, W) uint8 RGB 张量
+
+    source 可以是文件路径、编码后的图像字节、HWC 或 CHW 的 NumPy 数组/张量（uint8，或取值 0~1 的浮点）。
+    """
+    if isinstance(source, str):
+        return torchvision.io.read_image(source, mode=torchvision.io.ImageReadMode.RGB)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        encoded = torch.frombuffer(bytearray(source), dtype=torch.uint8)
+        return torchvision.io.decode_image(encoded, mode=torchvision.io.ImageReadMode.RGB)
+    if isinstance(source, np.ndarray):
+        source = torch.from_numpy(np.ascontiguousarray(source))
+    if not isinstance(source, torch.Tensor):
+        raise TypeError(f"unsupported image type: {type(source).__name__}")
+    tensor = source.unsqueeze(0) if source.dim() == 2 else source
+    if tensor.shape[0] not in (1, 3, 4) and tensor.shape[-1] in (1, 3, 4):
+        tensor = tensor.permute(2, 0, 1)
+    if tensor.shape[0] == 1:
+        tensor = tensor.expand(3, -1, -1)
+    elif tensor.shape[0] == 4:
+        tensor = tensor[:3]
+    if tensor.is_floating_point():
+        tensor = (tensor.clamp(0, 1) * 255).round()
+    return tensor.to(torch.uint8).contiguous()
+
+
+def read_input(analyzer: FaceAnalyzer, source: ImageSource, fix_img_size: bool = False) -> ImageData:
+    """路径走 reader，字节、数组和张量在内存中解码后直接构造 ImageData"""
+    if isinstance(source, str):
+        return read_image(analyzer, source, fix_img_size=fix_img_size)
+    return read_tensor(analyzer, decode_image(source), fix_img_size=fix_img_size)
+
+
+def face_to_dict(face: Face) -> Dict:
+    """人脸结果中可以直接序列化为 JSON 的部分"""
+    preds = {}
+    for name, pred in face.preds.items():
+        other = {key: value for key, value in pred.other.items() if isinstance(value, (str, int, float, list))}
+        preds[name] = {"label": pred.label, **other}
+    return {"indx": face.indx, "loc": face.loc.__dict__, "dims": face.dims.__dict__, "preds": preds}
+
+
+def predict_batch(data: ImageData, predictor, predictor_name: str, batch_size: int):
+    n_faces = len(data.faces)
+    with timed_stage(f"predict.{predictor_name}"):
+        for face_indx_start in range(0, n_faces, batch_size):
+            face_indx_end = min(face_indx_start + batch_size, n_faces)
+            face_batch_tensor = torch.stack([face.tensor for face in data.faces[face_indx_start:face_indx_end]])
+            preds = predictor.run(face_batch_tensor)
+            data.add_preds(preds, predictor_name, face_indx_start)
+
+
+def predict_subset(data: ImageData, predictor, predictor_name: str, face_indices: List[int], batch_size: int):
+    """只对部分人脸执行预测器"""
+    with timed_stage(f"predict.{predictor_name}"):
+        for start in range(0, len(face_indices), batch_size):
+            batch_indices = face_indices[start:start + batch_size]
+            face_batch_tensor = torch.stack([data.faces[i].tensor for i in batch_indices])
+            preds = predictor.run(face_batch_tensor)
+            for i, pred in zip(batch_indices, preds):
+                data.faces[i].preds[predictor_name] = pred
+
+
+def detect_faces(analyzer: FaceAnalyzer, data: ImageData, path_output: str = None, unify: bool = True) -> ImageData:
+    """人脸检测，检测到人脸时接着做对齐统一；不执行预测器时 unify=False 可跳过统一"""
+    data.path_output = None if path_output == "None" else path_output
+    analyzer.logger.info("Detecting faces")
+    with timed_stage("detect"):
+        data = analyzer.detector.run(data)
+    analyzer.logger.info("Number of faces: %d", len(data.faces))
+    if unify and len(data.faces) > 0 and analyzer.unifier is not None:
+        analyzer.logger.info("Unifying faces")
+        with timed_stage("unify"):
+            data = analyzer.unifier.run(data)
+    return data
+
+
+def detect_batch(analyzer: FaceAnalyzer, datas: List[ImageData], unify: bool = True) -> List[ImageData]:
+    """同尺寸的多帧拼成一个批次，检测模型只推理一次；NMS、裁剪人脸和统一仍逐帧进行
+
+    尺寸不一致时退回逐帧 detect_faces。
+    """
+    if len(datas) < 2 or len({tuple(data.tensor.shape[1:]) for data in datas}) > 1:
+        return [detect_faces(analyzer, data, unify=unify) for data in datas]
+    detector = analyzer.detector
+    analyzer.logger.info("Detecting faces in %d frames", len(datas))
+    with timed_stage("detect"):
+        batch = ImageData(path_input=None)
+        batch.tensor = torch.cat([data.tensor for data in datas])
+        batch = detector.preprocessor.run(batch)
+        logits = detector.inference(batch.tensor)
+        datas = list(datas)
+        for i, data in enumerate(datas):
+            data.path_output = None
+            # 与 FaceDetector.run 相同，后处理拿到的是本帧预处理后的张量和对应的模型输出
+            data.tensor = batch.tensor[i:i + 1]
+            if isinstance(logits, (list, tuple)):
+                datas[i] = detector.postprocessor.run(data, type(logits)(output[i:i + 1] for output in logits))
+            else:
+                datas[i] = detector.postprocessor.run(data, logits[i:i + 1])
+    for i, data in enumerate(datas):
+        analyzer.logger.info("Number of faces: %d", len(data.faces))
+        if unify and len(data.faces) > 0 and analyzer.unifier is not None:
+            with timed_stage("unify"):
+                datas[i] = analyzer.unifier.run(data)
+    return datas
+
+
+def merge_faces(datas: List[ImageData]) -> ImageData:
+    """把多帧的人脸放进同一个 ImageData，Face 对象共用，对它执行的预测结果直接写回各帧"""
+    merged = ImageData(path_input=None)
+    merged.faces = [face for data in datas for face in data.faces]
+    return merged
+
+
+def predict_faces(analyzer: FaceAnalyzer, data: ImageData, batch_size: int = 8,
+                  predictor_names: Iterable[str] = None) -> ImageData:
+    """按配置顺序执行预测器，predictor_names 为 None 时执行全部"""
+    analyzer.logger.info("Predicting facial features")
+    # 只遍历名称，未选择的预测器不会被延迟加载
+    for predictor_name in analyzer.predictors:
+        if predictor_names is not None and predictor_name not in predictor_names:
+            continue
+        analyzer.logger.info("Running FacePredictor: %s", predictor_name)
+        predict_batch(data, analyzer.predictors[predictor_name], predictor_name, batch_size)
+    return data
+
+
+def utilize_faces(analyzer: FaceAnalyzer, data: ImageData, utilizer_names: Iterable[str] = None) -> ImageData:
+    analyzer.logger.info("Utilizing facial features")
+    for utilizer_name in analyzer.utilizers:
+        if utilizer_names is not None and utilizer_name not in utilizer_names:
+            continue
+        analyzer.logger.info("Running BaseUtilizer: %s", utilizer_name)
+        with timed_stage(f"utilize.{utilizer_name}"):
+            data = analyzer.utilizers[utilizer_name].run(data)
+    return data
+
+
+def finish(analyzer: FaceAnalyzer, data: ImageData, return_img_data: bool = False,
+           include_tensors: bool = False) -> Union[Response, ImageData]:
+    if not include_tensors:
+        data.reset_tensors()
+    if return_img_data:
+        return data
+    return Response(faces=data.faces, version=data.version)
+
+
+def analyze_data(analyzer: FaceAnalyzer, data: ImageData, batch_size: int = 8, return_img_data: bool = False,
+                 include_tensors: bool = False, path_output: str = None, predictors: Iterable[str] = None,
+                 utilizers: Iterable[str] = None, batcher=None) -> Union[Response, ImageData]:
+    """对已读取的图像执行检测、对齐、预测和后处理，与 FaceAnalyzer.run 读取之后的流程一致
+
+    predictors/utilizers 可以只选择部分模型，未选择的模型完全不执行；
+    只有需要返回或保存图像时才执行绘制。传入 batcher（MicroBatcher）时预测器与其他并发请求合批执行，
+    传入 PredictorStage 时共享预处理并行执行各预测器。
+    """
+    draw = return_img_data or path_output not in (None, "None")
+    predictor_names, utilizer_names = select_stages(analyzer, predictors, utilizers, draw=draw)
+    data = detect_faces(analyzer, data, path_output=path_output, unify=bool(predictor_names))
+    if len(data.faces) > 0 and analyzer.unifier is not None:
+        if batcher is not None:
+            data = batcher.predict(data, predictor_names)
+        else:
+            data = predict_faces(analyzer, data, batch_size=batch_size, predictor_names=predictor_names)
+        data = utilize_faces(analyzer, data, utilizer_names=utilizer_names)
+    elif "save" in analyzer.utilizers:
+        analyzer.utilizers["save"].run(data)
+    return finish(analyzer, data, return_img_data=return_img_data, include_tensors=include_tensors)
+
+
+def analyze_frames(analyzer: FaceAnalyzer, datas: List[ImageData], batch_size: int = 8,
+                   predictors: Iterable[str] = None, utilizers: Iterable[str] = None,
+                   batcher=None) -> List[Response]:
+    """对一批帧执行 analyze_data 的流程，不绘制也不保存
+
+    检测按帧批次推理，各帧的人脸合在一起按 batch_size 分批送入预测器，后处理逐帧执行。
+    """
+    predictor_names, utilizer_names = select_stages(analyzer, predictors, utilizers, draw=False)
+    datas = detect_batch(analyzer, datas, unify=bool(predictor_names))
+    if analyzer.unifier is not None:
+        merged = merge_faces(datas)
+        if len(merged.faces) > 0:
+            if batcher is not None:
+                batcher.predict(merged, predictor_names)
+            else:
+                predict_faces(analyzer, merged, batch_size=batch_size, predictor_names=predictor_names)
+        datas = [utilize_faces(analyzer, data, utilizer_names=utilizer_names) if len(data.faces) > 0 else data
+                 for data in datas]
+    return [finish(analyzer, data) for data in datas]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : precision_check.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 比较降低精度（int8/bf16）与 float32 预测器在样本集上的输出：标签一致率、logits 余弦漂移和耗时
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+import torch
+
+from batch import iter_inputs
+from loader import PRECISIONS, LazyFaceAnalyzer
+from main import cfg, logger
+from pipeline import detect_faces, read_image
+
+
+def collect_faces(analyzer: LazyFaceAnalyzer, paths: Iterable[str], fix_img_size: bool = True) -> List[torch.Tensor]:
+    """检测并统一样本中的人脸，预测器的输入与正常推理一致"""
+    faces = []
+    for path in paths:
+        data = detect_faces(analyzer, read_image(analyzer, path, fix_img_size=fix_img_size))
+        faces.extend(face.tensor for face in data.faces)
+    return faces
+
+
+def compare_predictor(reference, candidate, faces: List[torch.Tensor], batch_size: int) -> Dict:
+    agree, drifts, max_diffs = 0, [], []
+    seconds = defaultdict(float)
+    for start in range(0, len(faces), batch_size):
+        batch = torch.stack(faces[start:start + batch_size])
+        t0 = time.perf_counter()
+        ref_preds = reference.run(batch)
+        t1 = time.perf_counter()
+        cand_preds = candidate.run(batch)
+        seconds["reference"] += t1 - t0
+        seconds["candidate"] += time.perf_counter() - t1
+        for ref, cand in zip(ref_preds, cand_preds):
+            agree += int(ref.label == cand.label)
+            ref_logits, cand_logits = ref.logits.flatten().float(), cand.logits.flatten().float()
+            cosine = torch.nn.functional.cosine_similarity(ref_logits, cand_logits, dim=0).item()
+            drifts.append(1 - cosine)
+            max_diffs.append((ref_logits - cand_logits).abs().max().item())
+    n = len(drifts)
+    return {
+        "faces": n,
+        "label_agreement": agree / n if n else None,
+        "mean_cosine_drift": sum(drifts) / n if n else None,
+        "max_cosine_drift": max(drifts) if n else None,
+        "max_abs_diff": max(max_diffs) if n else None,
+        "speedup": seconds["reference"] / seconds["candidate"] if seconds["candidate"] else None,
+    }
+
+
+def run_check(paths: Iterable[str], predictors: List[str], precision: str, batch_size: int = 8,
+              min_agreement: float = 0.99, max_drift: float = 0.01) -> Dict:
+    cache_dir = cfg.model_cache.dir if cfg.model_cache.enabled else None
+    reference = LazyFaceAnalyzer(cfg.analyzer, cache_dir=cache_dir)
+    candidate = LazyFaceAnalyzer(cfg.analyzer, cache_dir=cache_dir, precision={name: precision for name in predictors})
+    faces = collect_faces(reference, paths)
+    logger.info(f"comparing {precision} on {len(faces)} faces")
+
+    report = {"precision": precision, "min_agreement": min_agreement, "max_drift": max_drift, "predictors": {}}
+    for name in predictors:
+        # 预热一次，避免首次执行的图优化计入耗时
+        if faces:
+            reference.predictors[name].run(faces[0].unsqueeze(0))
+            candidate.predictors[name].run(faces[0].unsqueeze(0))
+        result = compare_predictor(reference.predictors[name], candidate.predictors[name], faces, batch_size)
+        result["within_tolerance"] = (result["faces"] > 0 and result["label_agreement"] >= min_agreement
+                                      and result["max_cosine_drift"] <= max_drift)
+        report["predictors"][name] = result
+        logger.info(f"{name}: {result}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查降低精度后预测器输出的偏差")
+    parser.add_argument("source", nargs="?", default="./test.jpg", help="目录、通配符或 .txt/.jsonl 清单")
+    parser.add_argument("--precision", choices=[p for p in PRECISIONS if p != "fp32"], default="int8")
+    parser.add_argument("--predictors", default=None, help="逗号分隔，默认全部预测器")
+    parser.add_argument("--batch-size", type=int, default=cfg.batch_size)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--max-drift", type=float, default=0.01)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    names = args.predictors.split(",") if args.predictors else list(cfg.analyzer.predictor)
+    report = run_check(iter_inputs(args.source), names, args.precision, args.batch_size,
+                       args.min_agreement, args.max_drift)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    sys.exit(0 if all(result["within_tolerance"] for result in report["predictors"].values()) else 1)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : predict_stage.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 预测器执行阶段：相同的预处理步骤只计算一次，互不依赖的预测器在线程池中并行推理，线程数在各预测器间平分
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torchvision
+from facetorch import FaceAnalyzer
+from facetorch.datastruct import ImageData, Prediction
+from facetorch.utils import fix_transform_list_attr, rgb2bgr
+from hydra.utils import instantiate
+from omegaconf import DictConfig, OmegaConf
+
+from pipeline import timed_stage
+
+PREPROCESSOR_TARGET = "facetorch.analyzer.predictor.pre.PredictorPreProcessor"
+
+
+class _Steps:
+    """从配置还原的预处理步骤，每一步带有由配置生成的键，配置相同的步骤键相同"""
+
+    def __init__(self, cfg: DictConfig):
+        self.keys = [json.dumps(OmegaConf.to_container(item, resolve=True), sort_keys=True)
+                     for item in cfg.transform.transforms]
+        # 与 BaseProcessor 相同，把 ListConfig 属性转换为 list
+        self.transforms = fix_transform_list_attr(instantiate(cfg.transform)).transforms
+        self.reverse_colors = bool(cfg.get("reverse_colors", False))
+
+
+def _skip(transform, faces: torch.Tensor) -> bool:
+    # 输入已经是目标尺寸时跳过缩放，例如 deepfake 的 380x380 与 unifier 输出相同
+    if not isinstance(transform, torchvision.transforms.Resize):
+        return False
+    size = transform.size if isinstance(transform.size, (list, tuple)) else [transform.size]
+    return len(size) == 2 and list(faces.shape[-2:]) == list(size)
+
+
+class PredictorStage:
+    """与 MicroBatcher 相同的 predict(data, predictor_names) 接口，可作为 analyze_data 的 batcher 传入
+
+    预处理器是 PredictorPreProcessor 的预测器按配置中的变换序列共享前缀结果，其余预测器照常调用 run。
+    workers 大于 1 时各预测器的推理在线程池中并行，每个线程的 intra-op 线程数为 torch.get_num_threads() // workers。
+    """
+
+    def __init__(self, analyzer: FaceAnalyzer, batch_size: int = 8, workers: int = 1,
+                 shared_preprocess: bool = True):
+        self.analyzer = analyzer
+        self.batch_size = batch_size
+        self.shared_preprocess = shared_preprocess
+        self.workers = max(1, min(workers, len(analyzer.predictors)))
+        self.threads_per_worker = max(1, torch.get_num_threads() // self.workers)
+        self._steps: Dict[str, Optional[_Steps]] = {}
+        self._steps_lock = threading.Lock()
+        self._pool = None
+        if self.workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="predictor",
+                                            initializer=torch.set_num_threads, initargs=(self.threads_per_worker,))
+
+    def _get_steps(self, name: str) -> Optional[_Steps]:
+        if name not in self._steps:
+            with self._steps_lock:
+                if name not in self._steps:
+                    cfg = self.analyzer.cfg.predictor[name].get("preprocessor")
+                    use = self.shared_preprocess and cfg is not None and cfg.get("_target_") == PREPROCESSOR_TARGET
+                    self._steps[name] = _Steps(cfg) if use else None
+        return self._steps[name]
+
+    def preprocess(self, faces: torch.Tensor, names: List[str]) -> Dict[str, torch.Tensor]:
+        """返回各预测器的模型输入；变换序列前缀相同的部分只计算一次"""
+        cache: Dict[Tuple[str, ...], torch.Tensor] = {}
+        inputs = {}
+        for name in names:
+            steps = self._get_steps(name)
+            if steps is None:
+                continue
+            predictor = self.analyzer.predictors[name]
+            prefix = (str(predictor.preprocessor.device),)
+            tensor = cache.get(prefix)
+            if tensor is None:
+                tensor = cache[prefix] = faces.to(predictor.preprocessor.device)
+            for key, transform in zip(steps.keys, steps.transforms):
+                prefix += (key,)
+                cached = cache.get(prefix)
+                if cached is None:
+                    cached = cache[prefix] = tensor if _skip(transform, tensor) else transform(tensor)
+                tensor = cached
+            inputs[name] = rgb2bgr(tensor) if steps.reverse_colors else tensor
+        return inputs
+
+    def _infer(self, name: str, faces: torch.Tensor, tensor: Optional[torch.Tensor]) -> List[Prediction]:
+        predictor = self.analyzer.predictors[name]
+        with timed_stage(f"predict.{name}"):
+            if tensor is None:
+                return predictor.run(faces)
+            return predictor.postprocessor.run(predictor.inference(tensor))
+
+    def run_tensors(self, faces: torch.Tensor, names: List[str]) -> Dict[str, List[Prediction]]:
+        with timed_stage("preprocess"):
+            inputs = self.preprocess(faces, names)
+        if self._pool is None or len(names) < 2:
+            return {name: self._infer(name, faces, inputs.get(name)) for name in names}
+        futures = {name: self._pool.submit(self._infer, name, faces, inputs.get(name)) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def predict(self, data: ImageData, predictor_names: List[str]) -> ImageData:
+        # 预测器按名称取用，未选择的模型不会被加载
+        names = [name for name in self.analyzer.predictors if name in set(predictor_names)]
+        if len(data.faces) == 0 or not names:
+            return data
+        for start in range(0, len(data.faces), self.batch_size):
+            faces = torch.stack([face.tensor for face in data.faces[start:start + self.batch_size]])
+            for name, preds in self.run_tensors(faces, names).items():
+                data.add_preds(preds, name, start)
+        return data
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : result_cache.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 按图像内容哈希和分析参数缓存推理结果，内存 LRU 加可选磁盘两级
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from loguru import logger
+
+
+def make_key(image_bytes: bytes, **options) -> str:
+    """图像内容哈希加上影响结果的参数（预测器集合、fix_img_size、include_tensors 等）"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """结果以 pickle 字节保存，按字节数淘汰；每次命中都反序列化出新对象，调用方修改结果不会污染缓存"""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, disk_dir: str = None,
+                 disk_max_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+        if blob is None and self.disk_dir:
+            blob = self._read_disk(key)
+            if blob is not None:
+                self._put_memory(key, blob)
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(blob)
+
+    def put(self, key: str, value: Any):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._put_memory(key, blob)
+        if self.disk_dir:
+            self._write_disk(key, blob)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _put_memory(self, key: str, blob: bytes):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            self._memory[key] = blob
+            self._memory_bytes += len(blob)
+            while self._memory_bytes > self.max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + ".pkl")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            return None
+        # 用 mtime 记录最近使用时间，淘汰时删除最久未用的文件
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return blob
+
+    def _write_disk(self, key: str, blob: bytes):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+        self._disk_bytes += len(blob)
+        # 计数只是估计（其他进程也可能写入），超出上限时再扫描目录精确淘汰
+        if self._disk_bytes > self.disk_max_bytes:
+            self._evict_disk()
+
+    def _disk_files(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith(".pkl"):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return files
+
+    def _evict_disk(self):
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+        logger.debug(f"result cache disk usage: {total} bytes")
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : serving.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 多进程推理服务，每个进程持有一个分析器副本并绑定一部分 CPU 核心，请求队列有界
+"""
+
+import collections
+import itertools
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeout
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from pipeline import report_stage
+
+
+class ServerBusy(RuntimeError):
+    """等待中的请求已达上限"""
+
+
+class AnalyzeTimeout(RuntimeError):
+    """请求在限定时间内没有返回结果"""
+
+
+class WorkerDied(RuntimeError):
+    """处理请求的工作进程异常退出"""
+
+
+def split_cores(workers: int) -> List[List[int]]:
+    """把当前进程可用的核心按连续区间平均分给各个工作进程"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    shares = []
+    for i in range(workers):
+        start, end = len(cores) * i // workers, len(cores) * (i + 1) // workers
+        shares.append(cores[start:end] or [cores[i % len(cores)]])
+    return shares
+
+
+def _worker(worker_id: int, cores: List[int], requests: mp.Queue, results: mp.Queue):
+    import torch
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    from main import get_analyzer, make_predictor_stage, warmup_analyzer
+    from metrics import torch_trace
+    from pipeline import add_stage_hook, analyze_data, read_input
+
+    # 新副本在领取请求之前完成模型加载和预热
+    analyzer = get_analyzer()
+    warmup_analyzer(analyzer)
+    # 在设置好本进程的线程数之后创建，预测器线程平分分到的核心
+    stage = make_predictor_stage(analyzer)
+
+    # 各阶段耗时随结果一起返回，由主进程汇总到监控指标
+    timings = []
+    add_stage_hook(lambda name, seconds: timings.append((name, seconds)))
+
+    logger.info(f"analyzer worker {worker_id} ready on cores {cores}")
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        request_id, kwargs = item
+        timings.clear()
+        try:
+            with torch_trace(kwargs.pop("profile_path", None)):
+                fix_img_size = kwargs.pop("fix_img_size", True)
+                image = kwargs.pop("image", None)
+                if image is None:
+                    image = kwargs.pop("image_path")
+                # 编码后的字节在这里解码，数组和张量直接使用
+                data = read_input(analyzer, image, fix_img_size=fix_img_size)
+                response = analyze_data(analyzer, data, batcher=stage, **kwargs)
+            results.put((worker_id, request_id, response, None, list(timings)))
+        except Exception as e:
+            logger.exception(f"analyzer worker {worker_id} failed")
+            results.put((worker_id, request_id, None, f"{type(e).__name__}: {e}", list(timings)))
+
+
+class AnalyzerPool:
+    """每个工作进程有自己的请求队列，主进程把请求交给空闲的进程，因此知道每个请求由哪个进程处理
+
+    等待和处理中的请求超过 queue_size 时拒绝新请求，实现背压。工作进程异常退出时，它正在处理的请求以
+    WorkerDied 失败并释放名额，随后在同一组核心上启动新的进程接替。
+    """
+
+    def __init__(self, workers: int, queue_size: int = 64):
+        self._ctx = mp.get_context("spawn")
+        self.queue_size = queue_size
+        self._results = self._ctx.Queue()
+        self._slots = threading.BoundedSemaphore(queue_size)
+        # 请求在返回结果、超时后被丢弃或所在进程退出之前一直占用一个名额
+        self._futures: Dict[int, Future] = {}
+        self._pending = collections.deque()
+        self._running: Dict[int, int] = {}  # 工作进程序号 -> 正在处理的请求
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closed = False
+        self._cores = split_cores(workers)
+        self._workers = [self._spawn(i) for i in range(len(self._cores))]
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+        self._monitor = threading.Thread(target=self._watch, daemon=True)
+        self._monitor.start()
+
+    def _spawn(self, index: int):
+        requests = self._ctx.Queue()
+        process = self._ctx.Process(target=_worker, args=(index, self._cores[index], requests, self._results),
+                                    daemon=True)
+        process.start()
+        return process, requests
+
+    @property
+    def pids(self) -> List[int]:
+        return [process.pid for process, _ in self._workers if process.is_alive()]
+
+    @property
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._futures)
+
+    def submit(self, timeout: Optional[float] = 0, **kwargs) -> Future:
+        """kwargs 为 image_path 或 image、fix_img_size、profile_path 以及 analyze_data 的参数
+
+        image 最好是编码后的图像字节，由工作进程解码，进程间传递的数据量远小于解码后的张量；
+        也可以是 NumPy 数组或 uint8 张量。
+
+        名额已满时等待 timeout 秒，0 为立即拒绝，None 为一直等待，等不到名额时抛出 ServerBusy。
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise ServerBusy(f"{self.queue_size} requests are already waiting")
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._futures[request_id] = future
+            self._pending.append((request_id, kwargs))
+            self._assign()
+        return future
+
+    def analyze(self, timeout: float = None, **kwargs):
+        future = self.submit(**kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # 还没开始的请求不再交给工作进程，已经在处理的请求结果到达后丢弃
+            future.cancel()
+            raise AnalyzeTimeout(f"no result within {timeout} seconds")
+
+    def _assign(self):
+        """调用方持有 self._lock"""
+        for index, (_, requests) in enumerate(self._workers):
+            while self._pending and index not in self._running:
+                request_id, kwargs = self._pending.popleft()
+                if self._futures[request_id].cancelled():
+                    del self._futures[request_id]
+                    self._slots.release()
+                    continue
+                self._running[index] = request_id
+                requests.put((request_id, kwargs))
+
+    def _finish(self, request_id: int) -> Optional[Future]:
+        """调用方持有 self._lock；取出请求并释放名额，已经处理过的请求返回 None"""
+        future = self._futures.pop(request_id, None)
+        if future is not None:
+            self._slots.release()
+        return future
+
+    @staticmethod
+    def _resolve(future: Optional[Future], result=None, error: Exception = None):
+        if future is None or future.cancelled():
+            return
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            # 与超时后的 cancel 同时发生
+            pass
+
+    def _dispatch(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            worker_id, request_id, result, error, timings = item
+            with self._lock:
+                if self._running.get(worker_id) == request_id:
+                    del self._running[worker_id]
+                future = self._finish(request_id)
+                self._assign()
+            for name, seconds in timings:
+                report_stage(name, seconds)
+            self._resolve(future, result, RuntimeError(error) if error is not None else None)
+
+    def _watch(self):
+        while not self._closed:
+            sentinels = {process.sentinel: index for index, (process, _) in enumerate(self._workers)}
+            for sentinel in wait(list(sentinels), timeout=1):
+                if self._closed:
+                    return
+                self._restart(sentinels[sentinel])
+
+    def _restart(self, index: int):
+        with self._lock:
+            process, _ = self._workers[index]
+            process.join()
+            logger.error(f"analyzer worker {index} (pid {process.pid}) exited with code {process.exitcode}, "
+                         f"restarting")
+            request_id = self._running.pop(index, None)
+            future = self._finish(request_id) if request_id is not None else None
+            self._workers[index] = self._spawn(index)
+            self._assign()
+        self._resolve(future, error=WorkerDied(f"analyzer worker {index} exited with code {process.exitcode}"))
+
+    def close(self):
+        self._closed = True
+        for _, requests in self._workers:
+            requests.put(None)
+        for process, _ in self._workers:
+            process.join(timeout=5)
+        self._results.put(None)
+        self._dispatcher.join(timeout=5)
+        self._monitor.join(timeout=5)
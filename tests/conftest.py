@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : conftest.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 测试从仓库根目录导入模块，与直接运行脚本时相同
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : test_benchmark.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 基准冒烟测试：在当前进程中执行一组参数，多次计时运行都能完成；需要事先下载好的模型文件，不访问网络
+"""
+
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("facetorch")
+
+from omegaconf import OmegaConf  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _model_nodes(node):
+    """配置中带 path_local 的节点（检测器、预测器和后处理器的模型文件）"""
+    if isinstance(node, dict):
+        found = [node] if isinstance(node.get("path_local"), str) else []
+        return found + [child for value in node.values() for child in _model_nodes(value)]
+    if isinstance(node, list):
+        return [child for value in node for child in _model_nodes(value)]
+    return []
+
+
+@pytest.fixture
+def offline_cfg(tmp_path):
+    """模型路径改为仓库中的绝对路径，日志和冻结模型缓存写到 tmp_path；缺少模型文件时跳过，不去下载"""
+    import benchmark
+
+    container = OmegaConf.to_container(benchmark.cfg, resolve=False)
+    for node in _model_nodes(container["analyzer"]):
+        path = os.path.normpath(os.path.join(ROOT, node["path_local"]))
+        if not os.path.exists(path):
+            pytest.skip(f"model file {node['path_local']} is not downloaded")
+        node["path_local"] = path
+    container["analyzer"]["logger"]["path_file"] = str(tmp_path / "logs" / "main.log")
+    container["model_cache"]["dir"] = str(tmp_path / "frozen")
+    return OmegaConf.create(container)
+
+
+def test_run_config_measures_several_runs(monkeypatch, tmp_path, offline_cfg):
+    import benchmark
+
+    # test.jpg 按相对路径读取，其余输出都留在 tmp_path 中
+    shutil.copyfile(os.path.join(ROOT, "test.jpg"), tmp_path / "test.jpg")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(benchmark, "cfg", offline_cfg)
+    monkeypatch.setattr(benchmark, "SYNTHETIC_IMAGES", [("test", 1, None), ("blank_320", 0, (320, 320))])
+    config = {"batch_size": 2, "fix_img_size": True, "optimize_transforms": True, "threads": 2,
+              "engine": "torchscript"}
+    result = benchmark._run_config(config, repeat=3, warmup_runs=1)
+
+    test_image = result["images"]["test"]
+    assert test_image["faces"] > 0
+    assert test_image["stages"]["total"]["n"] == 3
+    assert test_image["stages"]["detect"]["n"] == 3
+    assert any(name.startswith("predict.") for name in test_image["stages"])
+    assert result["images"]["blank_320"]["faces"] == 0
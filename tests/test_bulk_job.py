@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : test_bulk_job.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 分片批量任务：LocalDataRepo 作为对象存储、LocalCoordinator 协调，覆盖规划、检查点续跑、租约丢失和结果合并
+"""
+
+import json
+import time
+
+import pytest
+
+pytest.importorskip("facetorch")
+pytest.importorskip("minio")
+pytest.importorskip("pysftp")
+
+import bulk_job  # noqa: E402
+from bulk_job import JobSpec, ShardLost, ShardRunner, collect_results, ensure_plan  # noqa: E402
+
+N_IMAGES = 24
+
+
+class Crash(BaseException):
+    """模拟进程崩溃：不是 Exception，不会被当作单个对象的失败记录下来"""
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _analyze(data):
+    return [{"value": data}]
+
+
+@pytest.fixture
+def make_spec(tmp_path):
+    root = tmp_path / "repo"
+    for i in range(N_IMAGES):
+        path = root / "imgs" / str(i % 3) / f"{i:03d}.jpg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(str(i), encoding="utf-8")
+    (root / "imgs" / "notes.txt").write_text("not an image", encoding="utf-8")
+    repo_cfg = tmp_path / "repo.cfg"
+    repo_cfg.write_text(f"[local]\nroot={root}\n\n[control]\nstorage=local\n", encoding="utf-8")
+
+    def make(**kwargs):
+        options = dict(prefix="imgs", job_prefix="jobs/imgs", n_shards=1, repo_cfg=str(repo_cfg),
+                       coordinator=str(tmp_path / "coordinator.json"), checkpoint_every=5,
+                       checkpoint_seconds=3600, read_workers=2, prefetch=4)
+        options.update(kwargs)
+        return JobSpec(**options)
+
+    return make
+
+
+def _collect(spec, tmp_path):
+    path_output = tmp_path / "results.jsonl"
+    collect_results(spec, str(path_output))
+    with open(path_output, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_run_and_collect(make_spec, tmp_path):
+    spec = make_spec(n_shards=4)
+    runner = ShardRunner(spec, owner="a", read=_read, analyze=_analyze)
+    stats = runner.run()
+    assert stats["images"] == N_IMAGES and stats["errors"] == 0
+
+    manifest = runner.repo.read_text(spec.manifest(0)).splitlines()[0]
+    # 清单带有列举元数据，处理时不再逐个 stat
+    assert json.loads(manifest)["etag"]
+
+    records = _collect(spec, tmp_path)
+    assert sorted(record["path"] for record in records) == sorted(
+        f"imgs/{i % 3}/{i:03d}.jpg" for i in range(N_IMAGES))
+    assert all(record["faces"] == [{"value": str(int(record["path"][-7:-4]))}] for record in records)
+
+
+def test_resume_from_checkpoint_after_lease_expiry(make_spec, tmp_path):
+    spec = make_spec(lease_seconds=0.2)
+    calls = []
+
+    def crash_on_13th(data):
+        calls.append(data)
+        if len(calls) == 13:
+            raise Crash()
+        return _analyze(data)
+
+    with pytest.raises(Crash):
+        ShardRunner(spec, owner="a", read=_read, analyze=crash_on_13th).run()
+    runner = ShardRunner(spec, owner="b", read=_read, analyze=_analyze)
+    # 检查点在第 5、10 个对象之后
+    assert len(runner.repo.read_text(spec.partial(0)).splitlines()) == 10
+
+    time.sleep(0.3)
+    stats = runner.run()
+    assert stats["skipped"] == 10
+    assert stats["images"] == N_IMAGES - 10
+    assert runner.repo.stat_entry(spec.partial(0)) is None
+    paths = [record["path"] for record in _collect(spec, tmp_path)]
+    assert len(paths) == len(set(paths)) == N_IMAGES
+
+
+def test_lost_lease_stops_the_shard(make_spec):
+    spec = make_spec(lease_seconds=0.2)
+    thief = bulk_job.LocalCoordinator(spec.coordinator, owner="thief", lease_seconds=60)
+    calls = []
+
+    def steal_on_3rd(data):
+        calls.append(data)
+        if len(calls) == 3:
+            time.sleep(0.3)
+            assert thief.claim("shard-00000")
+        return _analyze(data)
+
+    runner = ShardRunner(spec, owner="a", read=_read, analyze=steal_on_3rd)
+    ensure_plan(runner.repo, runner.coordinator, spec)
+    assert runner.coordinator.claim("shard-00000")
+    with pytest.raises(ShardLost):
+        runner.run_shard(0)
+    # 失去租约的进程既不写检查点也不写最终结果
+    assert len(calls) == 5
+    assert runner.repo.stat_entry(spec.partial(0)) is None
+    assert runner.repo.stat_entry(spec.result(0)) is None
+    assert not runner.coordinator.is_done("shard-00000")
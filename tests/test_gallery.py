@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : test_gallery.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 人脸底库：增删、检索、变更日志重放与保存后的重新加载，以及尚未登记时的检索
+"""
+
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("facetorch")
+
+from gallery import LOG_FILE, FaceGallery  # noqa: E402
+
+DIM = 8
+
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+def test_add_search_remove(tmp_path):
+    gallery = FaceGallery(str(tmp_path), dim=DIM, dtype="float32", capacity=2, chunk_rows=3)
+    vectors = _vectors(5)
+    gallery.add([f"id{i}" for i in range(5)], vectors)
+    assert len(gallery) == 5
+
+    results = gallery.search(vectors[[1, 3]], k=2)
+    assert [result[0][0] for result in results] == ["id1", "id3"]
+    assert results[0][0][1] == pytest.approx(1.0, abs=1e-5)
+
+    assert gallery.remove(["id1", "missing"]) == 1
+    assert "id1" not in gallery
+    assert all(face_id != "id1" for face_id, _ in gallery.search(vectors[1], k=5)[0])
+
+    # 删除后空出的行被复用
+    gallery.add(["id5"], _vectors(1, seed=1))
+    assert len(gallery) == 5 and "id5" in gallery
+
+
+def test_reload_replays_log_without_save(tmp_path):
+    gallery = FaceGallery.open(str(tmp_path), dim=DIM, dtype="float32")
+    vectors = _vectors(4)
+    for i in range(4):
+        gallery.add([f"id{i}"], vectors[i:i + 1])
+    gallery.remove(["id2"])
+    gallery.add(["id0"], vectors[3:4])
+
+    # 只追加日志，没有调用 save
+    reloaded = FaceGallery.open(str(tmp_path))
+    assert sorted(reloaded.ids) == ["id0", "id1", "id3"]
+    assert reloaded.search(vectors[3], k=2)[0][0][1] == pytest.approx(1.0, abs=1e-5)
+    assert {face_id for face_id, _ in reloaded.search(vectors[3], k=2)[0]} == {"id0", "id3"}
+
+    reloaded.save()
+    assert not os.path.exists(tmp_path / LOG_FILE)
+    assert sorted(FaceGallery.open(str(tmp_path)).ids) == ["id0", "id1", "id3"]
+
+
+def test_incomplete_log_tail_is_dropped(tmp_path):
+    gallery = FaceGallery.open(str(tmp_path), dim=DIM, dtype="float32")
+    gallery.add(["id0"], _vectors(1))
+    with open(tmp_path / LOG_FILE, "a", encoding="utf-8") as f:
+        f.write('{"add": "id1", "ro')
+
+    reloaded = FaceGallery.open(str(tmp_path))
+    assert reloaded.ids == ["id0"]
+    # 截掉残缺的行后，新的变更可以正常重放
+    reloaded.add(["id2"], _vectors(1, seed=2))
+    assert sorted(FaceGallery.open(str(tmp_path)).ids) == ["id0", "id2"]
+
+
+def test_empty_gallery(tmp_path):
+    path = str(tmp_path / "gallery")
+    assert not FaceGallery.exists(path)
+    with pytest.raises(RuntimeError):
+        FaceGallery.open(path)
+    gallery = FaceGallery.open(path, dim=DIM)
+    assert FaceGallery.exists(path)
+    assert gallery.search(_vectors(2), k=3) == [[], []]
+
+
+def test_search_gallery_before_first_enrollment(tmp_path, monkeypatch):
+    pytest.importorskip("loguru")
+    import main
+
+    monkeypatch.setattr(main.cfg.gallery.verify, "path", str(tmp_path / "verify"))
+    monkeypatch.setattr(main, "galleries", {})
+    assert main.search_gallery(response=None) == {}
+    assert not os.path.exists(tmp_path / "verify")
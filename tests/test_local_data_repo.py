@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : test_local_data_repo.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : LocalDataRepo 与 MinIO 的列举行为一致：对象形状、ETag、按完整键排序以及 start_after 分页
+"""
+
+from configparser import ConfigParser
+from itertools import islice
+
+import pytest
+
+pytest.importorskip("minio")
+pytest.importorskip("pysftp")
+
+from gradio_demo.filemanager.local_data_repo import LocalDataRepo  # noqa: E402
+
+KEYS = ["a.jpg", "a/b.jpg", "a/c/d.jpg", "a/c/e.jpg", "a0.jpg", "ab.jpg", "b/f.jpg", "c.jpg"]
+
+
+@pytest.fixture
+def repo(tmp_path):
+    for key in KEYS:
+        path = tmp_path / "root" / "data" / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(key, encoding="utf-8")
+    cp = ConfigParser()
+    cp.read_dict({"local": {"root": str(tmp_path / "root")}, "control": {"storage": "local"}})
+    return LocalDataRepo(cp)
+
+
+def test_recursive_listing_is_sorted_by_full_key(repo):
+    names = [repo.entry_name(obj) for obj in repo.iter_directory("data", recursive=True)]
+    assert names == sorted(f"data/{key}" for key in KEYS)
+
+
+def test_start_after_pages_recursive_listing_without_gaps(repo):
+    names, start_after = [], None
+    while True:
+        page = [repo.entry_name(obj) for obj in islice(repo.iter_directory("data", True, start_after), 3)]
+        if not page:
+            break
+        names.extend(page)
+        start_after = page[-1]
+    assert names == sorted(f"data/{key}" for key in KEYS)
+
+
+def test_listing_has_minio_shape(repo):
+    objects = repo.list_directory("data")
+    assert [obj.object_name for obj in objects] == ["data/a.jpg", "data/a/", "data/a0.jpg", "data/ab.jpg",
+                                                    "data/b/", "data/c.jpg"]
+    assert [obj.is_dir for obj in objects] == [False, True, False, False, True, False]
+    entry = repo.list_entries("data")[0]
+    assert entry.etag and entry.size == len("a.jpg")
+
+    # 内容变化后 ETag 随之变化
+    path = repo.root / "data" / "a.jpg"
+    path.write_text("changed content", encoding="utf-8")
+    assert repo.stat_entry("data/a.jpg").etag != entry.etag
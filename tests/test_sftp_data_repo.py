@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : test_sftp_data_repo.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : SFTPDataRepo 的列举顺序和分页令牌，连接池替换为读取本地目录的假连接
+"""
+
+import os
+from configparser import ConfigParser
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("minio")
+pytest.importorskip("pysftp")
+
+from gradio_demo.filemanager import sftp_data_repo  # noqa: E402
+
+KEYS = ["a.txt", "a/b.txt", "a/c/d.txt", "a0.txt", "b/e.txt"]
+
+
+class LocalSFTP:
+    def listdir_attr(self, path):
+        return [SimpleNamespace(filename=entry.name, st_mode=entry.stat().st_mode) for entry in os.scandir(path)]
+
+
+class LocalPool:
+    def __init__(self, config, **kwargs):
+        pass
+
+    @contextmanager
+    def connection(self):
+        yield LocalSFTP()
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    for key in KEYS:
+        path = tmp_path / "data" / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(key, encoding="utf-8")
+    monkeypatch.setattr(sftp_data_repo, "SFTPConnectionPool", LocalPool)
+    cp = ConfigParser()
+    cp.read_dict({"sftp": {"host": "localhost", "port": "22", "user": "u", "passwd": "p", "basePath": str(tmp_path)},
+                  "control": {"storage": "sftp"}})
+    return sftp_data_repo.SFTPDataRepo(cp)
+
+
+def test_directory_and_file_sharing_a_prefix_page_without_gaps(repo):
+    names, token = [], None
+    while True:
+        page, token = repo.list_page("data", page_size=1, start_after=token)
+        names.extend(page)
+        if token is None:
+            break
+    # 目录以 'name/' 为键排序和分页，与 MinIO 的前缀相同
+    assert names == ["data/a.txt", "data/a/", "data/a0.txt", "data/b/"]
+
+
+def test_recursive_listing_resumes_inside_a_directory(repo):
+    names = list(repo.iter_directory("data", recursive=True))
+    assert names == sorted(f"data/{key}" for key in KEYS)
+    assert list(repo.iter_directory("data", recursive=True, start_after="data/a/b.txt")) == names[2:]
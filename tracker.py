@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : tracker.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 跨帧人脸跟踪，稳定的人脸复用上次的预测结果，只在新轨迹、定期刷新或位置漂移时重新预测
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import torch
+from facetorch import FaceAnalyzer
+from facetorch.datastruct import ImageData, Prediction
+
+from pipeline import merge_faces, predict_subset
+
+
+@dataclass
+class Track:
+    track_id: int
+    box: torch.Tensor
+    embedding: Optional[torch.Tensor] = None
+    refresh_box: Optional[torch.Tensor] = None
+    # 以处理过的帧计数，与抽帧步长无关
+    last_refresh: int = 0
+    last_seen: int = 0
+    preds: Dict[str, Prediction] = field(default_factory=dict)
+
+
+def _box(face) -> torch.Tensor:
+    return torch.tensor([face.loc.x1, face.loc.y1, face.loc.x2, face.loc.y2], dtype=torch.float32)
+
+
+def _copy_pred(pred: Prediction) -> Prediction:
+    # finish() 会就地清空预测的 logits 和 other，缓存和复用时都使用独立的副本
+    return Prediction(label=pred.label, logits=pred.logits.detach().clone(), other=dict(pred.other))
+
+
+def box_iou(boxes_a: torch.Tensor, boxes_b: torch.Tensor) -> torch.Tensor:
+    """(N, 4) 与 (M, 4) 两组框的 IoU 矩阵"""
+    top_left = torch.max(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = torch.min(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = (bottom_right - top_left).clamp(min=0).prod(dim=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).clamp(min=0).prod(dim=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).clamp(min=0).prod(dim=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter).clamp(min=1e-6)
+
+
+class FaceTracker:
+    """按 IoU 和嵌入向量相似度把检测结果关联到轨迹
+
+    每帧对所有人脸执行轻量预测器（其中 match_predictor 的输出用于关联），
+    expensive 中的预测器只在需要刷新的轨迹上执行，其余人脸沿用轨迹上缓存的结果。
+    refresh_interval 和 max_age 按处理过的帧数计算，抽帧步长变化时刷新频率不变。
+    """
+
+    def __init__(self, expensive: Iterable[str] = ("deepfake", "au", "embed"), match_predictor: str = "verify",
+                 iou_threshold: float = 0.3, sim_threshold: float = 0.5, refresh_interval: int = 30,
+                 drift_iou: float = 0.5, max_age: int = 10):
+        self.expensive = set(expensive)
+        self.match_predictor = match_predictor
+        self.iou_threshold = iou_threshold
+        self.sim_threshold = sim_threshold
+        self.refresh_interval = refresh_interval
+        self.drift_iou = drift_iou
+        self.max_age = max_age
+        self.tracks: List[Track] = []
+        self._next_id = 0
+        self.n_frames = 0
+        self.n_refreshed = 0
+        self.n_reused = 0
+
+    def _match(self, boxes: torch.Tensor, embeddings: Optional[torch.Tensor]) -> List[Optional[Track]]:
+        matches: List[Optional[Track]] = [None] * len(boxes)
+        if not self.tracks or len(boxes) == 0:
+            return matches
+        iou = box_iou(boxes, torch.stack([track.box for track in self.tracks]))
+        score = torch.where(iou >= self.iou_threshold, iou, torch.zeros_like(iou))
+        if embeddings is not None and all(track.embedding is not None for track in self.tracks):
+            track_embeddings = torch.stack([track.embedding for track in self.tracks])
+            sim = embeddings @ track_embeddings.T
+            # 快速移动导致 IoU 过低时仍可凭外观匹配；外观差异过大时即使重叠也不匹配
+            score = torch.where(sim >= self.sim_threshold, score + sim, torch.zeros_like(score))
+        # 贪心匹配：每次取得分最高的一对
+        while score.numel() and score.max() > 0:
+            face_i, track_i = divmod(int(score.argmax()), score.shape[1])
+            matches[face_i] = self.tracks[track_i]
+            score[face_i, :] = 0
+            score[:, track_i] = 0
+        return matches
+
+    def update(self, analyzer: FaceAnalyzer, data: ImageData, batch_size: int = 8) -> List[int]:
+        """为已检测并统一的人脸填充预测结果，返回每张人脸对应的轨迹编号；每处理一帧调用一次"""
+        return self.update_batch(analyzer, [data], batch_size)[0]
+
+    def update_batch(self, analyzer: FaceAnalyzer, datas: List[ImageData], batch_size: int = 8) -> List[List[int]]:
+        """按顺序处理一批帧，结果与逐帧调用 update 相同，返回每帧各人脸的轨迹编号
+
+        各帧的人脸合在一起分批预测：先对全部人脸执行轻量预测器，再逐帧关联轨迹、决定哪些人脸需要刷新，
+        最后对所有需要刷新的人脸一起执行耗时预测器，并按帧顺序把结果写入轨迹、分发给复用的人脸。
+        """
+        merged = merge_faces(datas)
+        cheap = [name for name in analyzer.predictors if name not in self.expensive]
+        all_indices = list(range(len(merged.faces)))
+        if all_indices:
+            for name in cheap:
+                predict_subset(merged, analyzer.predictors[name], name, all_indices, batch_size)
+
+        frames = [(data, *self._associate(data, self.match_predictor in cheap)) for data in datas]
+
+        refresh_indices = []
+        offset = 0
+        for data, _, refresh in frames:
+            refresh_indices.extend(offset + i for i in refresh)
+            offset += len(data.faces)
+        if refresh_indices:
+            for name in analyzer.predictors:
+                if name in self.expensive:
+                    predict_subset(merged, analyzer.predictors[name], name, refresh_indices, batch_size)
+
+        # 按帧顺序处理，复用的人脸拿到的是轨迹在该帧之前最近一次刷新的结果
+        for data, matches, refresh in frames:
+            for i, track in enumerate(matches):
+                if i in refresh:
+                    track.preds = {name: _copy_pred(data.faces[i].preds[name]) for name in self.expensive
+                                   if name in data.faces[i].preds}
+                else:
+                    data.faces[i].preds.update({name: _copy_pred(pred) for name, pred in track.preds.items()})
+            self.n_refreshed += len(refresh)
+            self.n_reused += len(data.faces) - len(refresh)
+        return [[track.track_id for track in matches] for _, matches, _ in frames]
+
+    def _associate(self, data: ImageData, use_embeddings: bool) -> Tuple[List[Track], List[int]]:
+        """把一帧的人脸关联到轨迹并推进帧计数，返回各人脸的轨迹和需要刷新的人脸序号"""
+        frame_index = self.n_frames
+        self.n_frames += 1
+        if len(data.faces) == 0:
+            self._expire(frame_index)
+            return [], []
+        boxes = torch.stack([_box(face) for face in data.faces])
+        embeddings = None
+        if use_embeddings:
+            embeddings = torch.stack([face.preds[self.match_predictor].logits.detach().float().cpu()
+                                      for face in data.faces])
+            embeddings = torch.nn.functional.normalize(embeddings, dim=1)
+
+        matches = self._match(boxes, embeddings)
+        refresh = []
+        for i, track in enumerate(matches):
+            if track is None:
+                track = Track(track_id=self._next_id, box=boxes[i])
+                self._next_id += 1
+                self.tracks.append(track)
+                matches[i] = track
+                refresh.append(i)
+            elif (frame_index - track.last_refresh >= self.refresh_interval
+                  or box_iou(boxes[i:i + 1], track.refresh_box[None])[0, 0] < self.drift_iou):
+                refresh.append(i)
+            track.box = boxes[i]
+            track.last_seen = frame_index
+            if embeddings is not None:
+                track.embedding = embeddings[i]
+        for i in refresh:
+            # 后续帧的漂移判断以刷新时的位置为准，预测结果在整批的耗时预测器执行后写入
+            matches[i].refresh_box = boxes[i]
+            matches[i].last_refresh = frame_index
+        self._expire(frame_index)
+        return matches, refresh
+
+    def _expire(self, frame_index: int):
+        self.tracks = [track for track in self.tracks if frame_index - track.last_seen <= self.max_age]
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+@File   : video.py
+@Author : yb_li
+@Date   : 2026/10/18
+@Desc   : 视频流式分析，直接从对象流解码并按步长抽帧，分批送入分析器
+"""
+
+import queue
+import threading
+from typing import BinaryIO, Dict, Iterator, List
+
+import av
+import torch
+from facetorch import FaceAnalyzer
+from facetorch.datastruct import ImageData
+
+from pipeline import analyze_frames, detect_batch, face_to_dict, finish, read_tensor, select_stages, utilize_faces
+from tracker import FaceTracker
+
+_END = object()
+
+
+def iter_frames(stream: BinaryIO, stride: int = 1) -> Iterator[Dict]:
+    """逐帧解码视频流，每 stride 帧取一帧，返回帧序号、时间戳和 (C, H, W) uint8 张量
+
+    输入可以是不可 seek 的流（如 MinIO 的 get_object 响应），此时要求视频的
+    moov 信息位于文件头部（faststart）或为分片 MP4。
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be >= 1, got {stride}")
+    with av.open(stream, mode="r") as container:
+        video_stream = container.streams.video[0]
+        video_stream.thread_type = "AUTO"
+        for index, frame in enumerate(container.decode(video_stream)):
+            if index % stride:
+                continue
+            tensor = torch.from_numpy(frame.to_ndarray(format="rgb24")).permute(2, 0, 1)
+            yield {"frame": index, "time": float(frame.time or 0.0), "tensor": tensor}
+
+
+def _put(frames: queue.Queue, item, stop: threading.Event) -> bool:
+    # 消费端已停止时不再阻塞
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _decode_worker(stream: BinaryIO, stride: int, frames: queue.Queue, stop: threading.Event):
+    try:
+        for frame in iter_frames(stream, stride):
+            if not _put(frames, frame, stop):
+                break
+    except Exception as e:
+        _put(frames, e, stop)
+    finally:
+        _put(frames, _END, stop)
+
+
+def _analyze_tracked(analyzer: FaceAnalyzer, datas: List[ImageData], batch_size: int,
+                     tracker: FaceTracker) -> List[List[Dict]]:
+    datas = detect_batch(analyzer, datas)
+    track_ids = [[] for _ in datas]
+    if analyzer.unifier is not None:
+        track_ids = tracker.update_batch(analyzer, datas, batch_size=batch_size)
+        _, utilizer_names = select_stages(analyzer, draw=False)
+        datas = [utilize_faces(analyzer, data, utilizer_names=utilizer_names) if len(data.faces) > 0 else data
+                 for data in datas]
+    faces = []
+    for data, frame_track_ids in zip(datas, track_ids):
+        response = finish(analyzer, data)
+        faces.append([{**face_to_dict(face), "track": track_id}
+                      for face, track_id in zip(response.faces, frame_track_ids)])
+    return faces
+
+
+def _analyze_batch(analyzer: FaceAnalyzer, frames: List[Dict], batch_size: int, fix_img_size: bool,
+                   tracker: FaceTracker = None) -> List[Dict]:
+    datas = [read_tensor(analyzer, frame["tensor"], fix_img_size=fix_img_size) for frame in frames]
+    if tracker is None:
+        faces = [[face_to_dict(face) for face in response.faces]
+                 for response in analyze_frames(analyzer, datas, batch_size=batch_size)]
+    else:
+        faces = _analyze_tracked(analyzer, datas, batch_size, tracker)
+    return [{"frame": frame["frame"], "time": frame["time"], "faces": frame_faces}
+            for frame, frame_faces in zip(frames, faces)]
+
+
+def analyze_stream(analyzer: FaceAnalyzer, stream: BinaryIO, stride: int = 5, frame_batch: int = 8,
+                   queue_size: int = 16, batch_size: int = 8, fix_img_size: bool = True,
+                   tracker: FaceTracker = None) -> Iterator[List[Dict]]:
+    """解码在后台线程中进行，通过有界队列交给分析器，每凑满 frame_batch 帧一起分析并返回这一批结果
+
+    同一批的帧一次送入检测模型，各帧的人脸合在一起按 batch_size 分批送入预测器。
+    队列长度限制了内存中的帧数，结果按批次返回而不累积，长视频的内存占用保持不变。
+    传入 tracker 时，稳定人脸的耗时预测器结果在帧间复用。
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be >= 1, got {stride}")
+    if frame_batch < 1:
+        raise ValueError(f"frame_batch must be >= 1, got {frame_batch}")
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    decoder = threading.Thread(target=_decode_worker, args=(stream, stride, frames, stop), daemon=True)
+    decoder.start()
+
+    pending = []
+    try:
+        while True:
+            frame = frames.get()
+            if frame is _END:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            pending.append(frame)
+            if len(pending) >= frame_batch:
+                yield _analyze_batch(analyzer, pending, batch_size, fix_img_size, tracker)
+                pending = []
+        if pending:
+            yield _analyze_batch(analyzer, pending, batch_size, fix_img_size, tracker)
+    finally:
+        stop.set()
+        decoder.join(timeout=1.0)